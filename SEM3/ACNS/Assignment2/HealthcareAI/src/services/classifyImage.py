@@ -1,37 +1,377 @@
 # classify_image.py
+#
+# One-shot CLI:
+#   python classifyImage.py <image_path> <text_prompt> [<text_prompt> ...]
+#   With several prompts the probabilities are a softmax across the prompts.
+#
+# Long-lived worker that keeps the model loaded between requests:
+#   python classifyImage.py --serve stdin
+#       reads one JSON request per line, e.g. {"id": 1, "image_path": "x.png", "text_prompt": "pneumonia"}
+#       or {"id": 2, "image_path": "x.png", "text_prompts": ["normal chest x-ray", "pneumonia"]}
+#       and writes one JSON response per line, echoing "id"
+#   python classifyImage.py --serve http --host 127.0.0.1 --port 8765
+#       POST /classify with the same JSON body, GET /health for readiness
+#       answers 400 for malformed requests or missing images, 500 when inference fails
+#
+# Offline batch mode over a directory tree or a manifest (one image path per line):
+#   python classifyImage.py --batch ./archive --output results.jsonl \
+#       --text-prompts "normal chest x-ray" "pneumonia" --batch-size 32 --workers 8
+#   Writes one JSON line per image. Re-running with the same --output skips the
+#   images that already have a result, so an interrupted job resumes where it stopped.
+#   Images that failed are tried again on every run, and a later success is
+#   appended after their error record: keep the last record of each image_path.
+import os
 import sys
 import json
-from PIL import Image
+import argparse
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from PIL import Image, UnidentifiedImageError
 import torch
 import open_clip
 
-def classify(image_path, text_prompt):
-    model, _, preprocess = open_clip.create_model_and_transforms(
-        'hf-hub:microsoft/BiomedCLIP-PubMedBERT_256-vit_base_patch16_224'
-    )
-    tokenizer = open_clip.get_tokenizer('hf-hub:microsoft/BiomedCLIP-PubMedBERT_256-vit_base_patch16_224')
+MODEL_NAME = 'hf-hub:microsoft/BiomedCLIP-PubMedBERT_256-vit_base_patch16_224'
 
-    image = preprocess(Image.open(image_path).convert("RGB")).unsqueeze(0)
-    text = tokenizer([text_prompt])
+# Maximum number of prompts whose text features are kept in memory
+TEXT_FEATURE_CACHE_SIZE = 4096
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+
+_model = None
+_model_lock = threading.Lock()
+
+_text_features = OrderedDict()
+_text_features_lock = threading.Lock()
+
+def load_model():
+    """Load BiomedCLIP once per process and return (model, preprocess, tokenizer)"""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                model, _, preprocess = open_clip.create_model_and_transforms(MODEL_NAME)
+                tokenizer = open_clip.get_tokenizer(MODEL_NAME)
+                model.eval()
+                _model = (model, preprocess, tokenizer)
+    return _model
+
+def encode_prompts(text_prompts):
+    """
+    Return normalized text features for each prompt, one row per prompt
+
+    Features are cached by prompt string, so only prompts that have not been
+    seen before are tokenized and encoded, all in a single batch.
+    """
+    model, _, tokenizer = load_model()
+
+    with _text_features_lock:
+        missing = [p for p in dict.fromkeys(text_prompts) if p not in _text_features]
+
+    if missing:
+        with torch.no_grad():
+            features = model.encode_text(tokenizer(missing), normalize=True)
+        with _text_features_lock:
+            for prompt, feature in zip(missing, features):
+                _text_features[prompt] = feature
+            while len(_text_features) > TEXT_FEATURE_CACHE_SIZE:
+                _text_features.popitem(last=False)
+
+    with _text_features_lock:
+        rows = []
+        for prompt in text_prompts:
+            # A prompt may have been evicted by another thread, recompute it if so
+            feature = _text_features.get(prompt)
+            if feature is None:
+                with torch.no_grad():
+                    feature = model.encode_text(tokenizer([prompt]), normalize=True)[0]
+            else:
+                _text_features.move_to_end(prompt)
+            rows.append(feature)
+    return torch.stack(rows)
+
+def score_prompts(image_path, text_prompts):
+    """Zero-shot score one image against several prompts with a single image forward pass"""
+    model, preprocess, _ = load_model()
 
-    with torch.no_grad(), torch.cuda.amp.autocast():
-        image_features = model.encode_image(image)
-        text_features = model.encode_text(text)
+    image = preprocess(Image.open(image_path).convert("RGB")).unsqueeze(0)
+    text_features = encode_prompts(text_prompts)
 
-        logits_per_image, logits_per_text = model(image, text)
-        probs = logits_per_image.softmax(dim=-1).cpu().numpy()
+    with torch.no_grad():
+        image_features = model.encode_image(image, normalize=True)
+        logits = model.logit_scale.exp() * image_features @ text_features.T
+        probs = logits.softmax(dim=-1).cpu().numpy()
 
     return {
+        "labels": list(text_prompts),
         "probabilities": probs[0].tolist()
     }
 
-if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print(json.dumps({ "error": "Usage: classify_image.py <image_path> <text_prompt>" }))
+def classify(image_path, text_prompt):
+    text_prompts = [text_prompt] if isinstance(text_prompt, str) else list(text_prompt)
+    result = score_prompts(image_path, text_prompts)
+    return {
+        "probabilities": result["probabilities"]
+    }
+
+class RequestError(ValueError):
+    """A request that is malformed or names a missing or unreadable image"""
+
+def validate_request(request):
+    """Raise RequestError unless request names an existing image and at least one prompt"""
+    if not isinstance(request, dict):
+        raise RequestError("Request must be a JSON object")
+    if "image_path" not in request:
+        raise RequestError("Missing field: image_path")
+    if "text_prompts" in request:
+        prompts = request["text_prompts"]
+        if not isinstance(prompts, list) or not prompts:
+            raise RequestError("text_prompts must be a non-empty list")
+    elif "text_prompt" in request:
+        prompts = [request["text_prompt"]]
+    else:
+        raise RequestError("Missing field: text_prompt")
+    if not all(isinstance(prompt, str) and prompt for prompt in prompts):
+        raise RequestError("Prompts must be non-empty strings")
+    if not isinstance(request["image_path"], str) or not os.path.isfile(request["image_path"]):
+        raise RequestError(f"Image not found: {request['image_path']}")
+
+def run_request(request):
+    """
+    Run one worker request, returning an HTTP status and the JSON-serializable
+    response: 400 for requests that cannot be served as sent, 500 when
+    inference fails
+    """
+    try:
+        validate_request(request)
+        if "text_prompts" in request:
+            status, result = 200, score_prompts(request["image_path"], request["text_prompts"])
+        else:
+            status, result = 200, classify(request["image_path"], request["text_prompt"])
+    except RequestError as e:
+        status, result = 400, { "error": str(e) }
+    except UnidentifiedImageError as e:
+        status, result = 400, { "error": f"Unreadable image: {e}" }
+    except Exception as e:
+        status, result = 500, { "error": str(e) }
+    if isinstance(request, dict) and "id" in request:
+        result["id"] = request["id"]
+    return status, result
+
+def handle_request(request):
+    """Run one worker request and return the JSON-serializable response"""
+    return run_request(request)[1]
+
+def serve_stdin(stdin=sys.stdin, stdout=sys.stdout):
+    """Answer JSON-lines requests from stdin until it is closed"""
+    load_model()
+    stdout.write(json.dumps({ "status": "ready" }) + "\n")
+    stdout.flush()
+
+    for line in stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            response = { "error": f"Invalid JSON: {e}" }
+        else:
+            response = handle_request(request)
+        stdout.write(json.dumps(response) + "\n")
+        stdout.flush()
+
+class ClassifyRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, { "status": "ready" })
+        else:
+            self._send_json(404, { "error": "Not found" })
+
+    def do_POST(self):
+        if self.path != "/classify":
+            self._send_json(404, { "error": "Not found" })
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length))
+        except ValueError as e:
+            self._send_json(400, { "error": f"Invalid JSON: {e}" })
+            return
+
+        status, response = run_request(request)
+        self._send_json(status, response)
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # Keep stdout free for results, log requests to stderr
+        sys.stderr.write("%s - %s\n" % (self.address_string(), format % args))
+
+def serve_http(host, port):
+    """Serve classification requests over a local HTTP socket"""
+    load_model()
+    server = ThreadingHTTPServer((host, port), ClassifyRequestHandler)
+    sys.stderr.write(f"Serving BiomedCLIP on http://{host}:{port}\n")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def list_images(source):
+    """List the images under a directory, or the paths in a manifest file, in a stable order"""
+    if os.path.isdir(source):
+        paths = []
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            paths.extend(os.path.join(root, name) for name in sorted(files) if name.lower().endswith(IMAGE_EXTENSIONS))
+        return paths
+
+    base_dir = os.path.dirname(os.path.abspath(source))
+    with open(source) as f:
+        lines = [line.strip() for line in f]
+    return [os.path.join(base_dir, line) for line in lines if line and not line.startswith("#")]
+
+def load_completed(output_path):
+    """
+    Return the image paths that already have a successful result in the output
+    file, and those that only have an error record
+
+    A partially written last line from an interrupted run is cut off, so the
+    records appended next start on a line of their own.
+    """
+    completed = set()
+    failed = set()
+    if not os.path.exists(output_path):
+        return completed, failed
+    with open(output_path, "rb+") as f:
+        end = 0
+        for line in f:
+            if not line.endswith(b"\n"):
+                f.truncate(end)
+                break
+            end += len(line)
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if "error" in record:
+                failed.add(record["image_path"])
+            else:
+                completed.add(record["image_path"])
+    return completed, failed - completed
+
+def _load_image(image_path, preprocess):
+    try:
+        with Image.open(image_path) as image:
+            return preprocess(image.convert("RGB")), None
+    except Exception as e:
+        return None, str(e)
+
+def classify_batch(source, output_path, text_prompts, batch_size=32, workers=4):
+    """
+    Classify every image under source against text_prompts and stream JSON lines to output_path
+
+    Images are decoded and preprocessed on a thread pool while the previous
+    batch runs through encode_image. Returns the number of images processed.
+    """
+    model, preprocess, _ = load_model()
+    text_features = encode_prompts(text_prompts)
+
+    completed, failed = load_completed(output_path)
+    pending = [path for path in list_images(source) if path not in completed]
+    sys.stderr.write(f"{len(completed)} images already classified, {len(pending)} to go "
+                     f"({len(failed)} failed before)\n")
+    batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+
+    processed = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool, open(output_path, "a") as out:
+        def submit(batch):
+            return [pool.submit(_load_image, path, preprocess) for path in batch]
+
+        next_loads = submit(batches[0]) if batches else None
+        for i, batch in enumerate(batches):
+            loads = next_loads
+            # Start decoding the next batch before running this one
+            next_loads = submit(batches[i + 1]) if i + 1 < len(batches) else None
+
+            records = []
+            tensors = []
+            paths = []
+            for path, future in zip(batch, loads):
+                tensor, error = future.result()
+                if error is not None:
+                    # An image that keeps failing gets a single error record
+                    if path not in failed:
+                        records.append({ "image_path": path, "error": error })
+                else:
+                    tensors.append(tensor)
+                    paths.append(path)
+
+            if tensors:
+                with torch.no_grad():
+                    image_features = model.encode_image(torch.stack(tensors), normalize=True)
+                    logits = model.logit_scale.exp() * image_features @ text_features.T
+                    probs = logits.softmax(dim=-1).cpu().numpy()
+                for path, row in zip(paths, probs):
+                    records.append({
+                        "image_path": path,
+                        "label": text_prompts[int(row.argmax())],
+                        "probabilities": row.tolist()
+                    })
+
+            out.write("".join(json.dumps(record) + "\n" for record in records))
+            out.flush()
+            processed += len(batch)
+            sys.stderr.write(f"{processed}/{len(pending)} images\n")
+
+    return processed
+
+def main(argv):
+    if argv and argv[0].startswith("--"):
+        parser = argparse.ArgumentParser(prog="classifyImage.py")
+        mode = parser.add_mutually_exclusive_group(required=True)
+        mode.add_argument("--serve", choices=["stdin", "http"])
+        mode.add_argument("--batch", metavar="DIR_OR_MANIFEST")
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument("--output", help="JSON lines file for --batch results")
+        parser.add_argument("--text-prompts", nargs="+", help="Candidate labels for --batch")
+        parser.add_argument("--batch-size", type=int, default=32)
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+        args = parser.parse_args(argv)
+
+        if args.batch:
+            if not args.output or not args.text_prompts:
+                parser.error("--batch requires --output and --text-prompts")
+            classify_batch(args.batch, args.output, args.text_prompts, args.batch_size, args.workers)
+        elif args.serve == "stdin":
+            serve_stdin()
+        else:
+            serve_http(args.host, args.port)
+        return
+
+    if len(argv) < 2:
+        print(json.dumps({ "error": "Usage: classify_image.py <image_path> <text_prompt> [<text_prompt> ...]" }))
         sys.exit(1)
 
-    image_path = sys.argv[1]
-    text_prompt = sys.argv[2]
+    image_path = argv[0]
+    text_prompts = argv[1:]
 
-    result = classify(image_path, text_prompt)
+    if len(text_prompts) == 1:
+        result = classify(image_path, text_prompts[0])
+    else:
+        result = score_prompts(image_path, text_prompts)
     print(json.dumps(result))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
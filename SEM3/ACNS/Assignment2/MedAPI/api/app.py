@@ -3,34 +3,32 @@ from flask_cors import CORS
 import os
 import time
 import logging
-from werkzeug.utils import secure_filename
 from PIL import Image
 import io
 import json
 
 # Import medical image analysis modules
-from models import get_model, list_available_models
-from utils import preprocess_image, format_results, setup_logging
+from models import list_available_models, warm_up_models
+from utils import setup_logging
+from batching import batched_predict, get_batching_metrics, QueueFullError
+from pipeline import (
+    UPLOAD_FOLDER, MAX_CONTENT_LENGTH, UPLOAD_SPILL_THRESHOLD, ALLOWED_EXTENSIONS,
+    result_cache, allowed_file, cache_bypass_requested, lookup_cached_results,
+    prepare_image, finalize_results
+)
 
 # Create Flask app
 app = Flask(__name__)
-CORS(app)  # Enable CORS for all routes
+CORS(app, expose_headers=['X-Cache'])  # Enable CORS for all routes
 
 # Configure logging
 setup_logging()
 logger = logging.getLogger(__name__)
 
 # Configure upload folder
-UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), 'uploads')
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload
-
-# Allowed file extensions
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
-
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
+app.config['UPLOAD_SPILL_THRESHOLD'] = UPLOAD_SPILL_THRESHOLD
 
 @app.route('/')
 def index():
@@ -40,7 +38,8 @@ def index():
         "status": "running",
         "endpoints": [
             {"path": "/api/analyze", "method": "POST", "description": "Analyze medical images"},
-            {"path": "/api/models", "method": "GET", "description": "List available models"}
+            {"path": "/api/models", "method": "GET", "description": "List available models"},
+            {"path": "/api/metrics", "method": "GET", "description": "Inference batching metrics"}
         ]
     })
 
@@ -50,6 +49,13 @@ def models():
         "models": list_available_models()
     })
 
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    return jsonify({
+        "batching": get_batching_metrics(),
+        "result_cache": result_cache.get_stats()
+    })
+
 @app.route('/api/analyze', methods=['POST'])
 def analyze():
     start_time = time.time()
@@ -77,57 +83,55 @@ def analyze():
     
     if file and allowed_file(file.filename):
         try:
-            # Secure the filename and save the file
-            filename = secure_filename(file.filename)
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
-            logger.info(f"Saved file to {filepath}")
+            # Serve re-submitted images from the result cache
+            bypass_cache = cache_bypass_requested(request.headers)
+            cache_key, cached_results = lookup_cached_results(file.stream, model_type, bypass_cache)
+            if cached_results is not None:
+                processing_time = time.time() - start_time
+                logger.info(f"Result cache hit for {file.filename}")
+                response = jsonify({
+                    "success": True,
+                    "model": model_type,
+                    "results": cached_results,
+                    "processing_time": f"{processing_time:.2f}s"
+                })
+                response.headers['X-Cache'] = 'HIT'
+                return response
             
             # Load and preprocess the image
-            image = Image.open(filepath)
-            processed_image = preprocess_image(image, model_type)
+            processed_image = prepare_image(file.stream, file.filename, model_type)
             
-            # Get the model and run inference
-            model = get_model(model_type)
-            results = model.predict(processed_image)
+            # Run inference through the model's micro-batching queue
+            results = batched_predict(model_type, processed_image)
             
-            print(results)
-            # Format the results
-            formatted_results = format_results(results, model_type)
-            #print(formatted_results)
-            # Log the results
-            logger.info(f"Results: {json.dumps(formatted_results, indent=2)}")
+            # Format and cache the results
+            response_results = finalize_results(results, model_type, cache_key)
             # Calculate processing time
             processing_time = time.time() - start_time
-
-            if(model_type == "medical-classification"):
-                # Return the results
-                return jsonify({
-                    "success": True,
-                    "model": model_type,
-                    "results": results,
-                    "processing_time": f"{processing_time:.2f}s"
-                })
-            elif(model_type == "medical-detection"): 
-                # Return the results
-                return jsonify({
-                    "success": True,
-                    "model": model_type,
-                    "results": formatted_results,
-                    "processing_time": f"{processing_time:.2f}s"
-                })
+            
+            # Return the results
+            response = jsonify({
+                "success": True,
+                "model": model_type,
+                "results": response_results,
+                "processing_time": f"{processing_time:.2f}s"
+            })
+            response.headers['X-Cache'] = 'BYPASS' if bypass_cache else 'MISS'
+            return response
             
             
+        except QueueFullError as e:
+            logger.warning(str(e))
+            return jsonify({
+                "success": False,
+                "error": "Server is busy, please retry"
+            }), 503
         except Exception as e:
             logger.exception("Error processing image")
             return jsonify({
                 "success": False,
                 "error": str(e)
             }), 500
-        finally:
-            # Clean up the uploaded file
-            if os.path.exists(filepath):
-                os.remove(filepath)
     
     else:
         logger.error(f"Invalid file type: {file.filename}")
@@ -138,4 +142,9 @@ def analyze():
 
 if __name__ == '__main__':
     logger.info("Starting Medical Image Analysis API")
+    # Load model weights once up front instead of on the first request. The
+    # debug reloader runs this script in a watcher process and in the child
+    # that serves requests (WERKZEUG_RUN_MAIN=true), only the child needs them.
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        warm_up_models()
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
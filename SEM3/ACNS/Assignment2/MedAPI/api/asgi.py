@@ -0,0 +1,164 @@
+from quart import Quart, request, jsonify
+from quart_cors import cors
+import asyncio
+import time
+import logging
+
+# Import medical image analysis modules
+from models import list_available_models, warm_up_models
+from utils import setup_logging
+from batching import get_batcher, get_batching_metrics, QueueFullError
+from workers import create_worker_pool
+from pipeline import (
+    MAX_CONTENT_LENGTH, result_cache, allowed_file, cache_bypass_requested,
+    lookup_cached_results, prepare_image, finalize_results
+)
+
+# Async variant of app.py: request parsing and I/O run on the event loop while
+# hashing, decoding and preprocessing run on a bounded worker pool and inference
+# on the micro-batching queue. Serve with an ASGI server, e.g.
+#   hypercorn asgi:app --bind 0.0.0.0:5000
+
+# Create Quart app
+app = Quart(__name__)
+app = cors(app, allow_origin="*", expose_headers=["X-Cache"])  # Enable CORS for all routes
+
+# Configure logging
+setup_logging()
+logger = logging.getLogger(__name__)
+
+app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
+
+# CPU bound request work is dispatched here; a full pool answers 503
+worker_pool = create_worker_pool()
+
+async def run_in_pool(fn, *args):
+    """Run a blocking function on the worker pool without blocking the event loop"""
+    return await asyncio.wrap_future(worker_pool.submit(fn, *args))
+
+@app.before_serving
+async def startup():
+    logger.info("Starting Medical Image Analysis API (async)")
+    # Load model weights once up front instead of on the first request
+    await asyncio.get_running_loop().run_in_executor(None, warm_up_models)
+
+@app.after_serving
+async def shutdown():
+    worker_pool.shutdown(wait=False)
+
+@app.route('/')
+async def index():
+    return jsonify({
+        "name": "Medical Image Analysis API",
+        "version": "1.0.0",
+        "status": "running",
+        "endpoints": [
+            {"path": "/api/analyze", "method": "POST", "description": "Analyze medical images"},
+            {"path": "/api/models", "method": "GET", "description": "List available models"},
+            {"path": "/api/metrics", "method": "GET", "description": "Inference batching metrics"}
+        ]
+    })
+
+@app.route('/api/models', methods=['GET'])
+async def models():
+    return jsonify({
+        "models": list_available_models()
+    })
+
+@app.route('/api/metrics', methods=['GET'])
+async def metrics():
+    return jsonify({
+        "batching": get_batching_metrics(),
+        "result_cache": result_cache.get_stats(),
+        "worker_pool": worker_pool.get_stats()
+    })
+
+@app.route('/api/analyze', methods=['POST'])
+async def analyze():
+    start_time = time.time()
+
+    files = await request.files
+    form = await request.form
+
+    # Check if the post request has the file part
+    if 'image' not in files:
+        logger.error("No image part in the request")
+        return jsonify({
+            "success": False,
+            "error": "No image file provided"
+        }), 400
+
+    file = files['image']
+
+    # If user does not select file, browser might submit an empty file
+    if file.filename == '':
+        logger.error("No selected file")
+        return jsonify({
+            "success": False,
+            "error": "No file selected"
+        }), 400
+
+    # Get the model type from the request
+    model_type = form.get('model', 'medical-classification')
+
+    if not allowed_file(file.filename):
+        logger.error(f"Invalid file type: {file.filename}")
+        return jsonify({
+            "success": False,
+            "error": "Invalid file type. Allowed types: png, jpg, jpeg"
+        }), 400
+
+    try:
+        # Serve re-submitted images from the result cache
+        bypass_cache = cache_bypass_requested(request.headers)
+        cache_key, cached_results = await run_in_pool(
+            lookup_cached_results, file.stream, model_type, bypass_cache
+        )
+        if cached_results is not None:
+            processing_time = time.time() - start_time
+            logger.info(f"Result cache hit for {file.filename}")
+            response = jsonify({
+                "success": True,
+                "model": model_type,
+                "results": cached_results,
+                "processing_time": f"{processing_time:.2f}s"
+            })
+            response.headers['X-Cache'] = 'HIT'
+            return response
+
+        # Load and preprocess the image
+        processed_image = await run_in_pool(prepare_image, file.stream, file.filename, model_type)
+
+        # Run inference through the model's micro-batching queue
+        results = await asyncio.wrap_future(get_batcher(model_type).submit(processed_image))
+
+        # Format and cache the results
+        response_results = await run_in_pool(finalize_results, results, model_type, cache_key)
+        # Calculate processing time
+        processing_time = time.time() - start_time
+
+        # Return the results
+        response = jsonify({
+            "success": True,
+            "model": model_type,
+            "results": response_results,
+            "processing_time": f"{processing_time:.2f}s"
+        })
+        response.headers['X-Cache'] = 'BYPASS' if bypass_cache else 'MISS'
+        return response
+
+    except QueueFullError as e:
+        logger.warning(str(e))
+        return jsonify({
+            "success": False,
+            "error": "Server is busy, please retry"
+        }), 503
+    except Exception as e:
+        logger.exception("Error processing image")
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,218 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List
+
+from models import get_model, parse_model_id, format_model_id
+
+logger = logging.getLogger(__name__)
+
+class QueueFullError(RuntimeError):
+    """Raised when a model's request queue is at capacity"""
+    pass
+
+class _PendingRequest:
+    """An image waiting to be included in a batch"""
+    def __init__(self, image):
+        self.image = image
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+class MicroBatcher:
+    """
+    Groups concurrent inference requests for one model type into batches
+
+    Requests are queued and a background worker flushes the queue as soon as
+    max_batch_size requests are waiting or the oldest request has waited
+    max_wait_ms. Each flush runs a single predict_batch call and resolves the
+    waiting requests with their own result.
+    """
+    def __init__(self, model_type: str, predict_batch: Callable[[List[Any]], List[Any]],
+                 max_batch_size: int = 8, max_wait_ms: float = 10.0, max_queue_size: int = 64):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.model_type = model_type
+        self.predict_batch = predict_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_queue_size = max_queue_size
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+
+        self.metrics = {
+            "requests": 0,
+            "rejected": 0,
+            "batches": 0,
+            "batched_images": 0,
+            "max_batch_size_seen": 0,
+            "errors": 0
+        }
+
+        self._worker = threading.Thread(target=self._run, name=f"batcher-{model_type}", daemon=True)
+        self._worker.start()
+
+    def submit(self, image) -> Future:
+        """
+        Queue an image for inference
+
+        Args:
+            image: The preprocessed image
+
+        Returns:
+            A future resolved with the prediction for this image
+
+        Raises:
+            QueueFullError: If max_queue_size requests are already waiting
+        """
+        request = _PendingRequest(image)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError(f"Batcher for '{self.model_type}' is closed")
+            if self.max_queue_size and len(self._queue) >= self.max_queue_size:
+                self.metrics["rejected"] += 1
+                raise QueueFullError(f"Inference queue for '{self.model_type}' is full")
+            self._queue.append(request)
+            self.metrics["requests"] += 1
+            self._cond.notify()
+        return request.future
+
+    def predict(self, image, timeout: float = None):
+        """Queue an image and block until its prediction is ready"""
+        return self.submit(image).result(timeout=timeout)
+
+    def queue_depth(self) -> int:
+        """Return the number of requests waiting for a batch"""
+        with self._cond:
+            return len(self._queue)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Return a snapshot of the batcher's counters and configuration"""
+        with self._cond:
+            metrics = dict(self.metrics)
+            metrics["queue_depth"] = len(self._queue)
+        metrics["avg_batch_size"] = (
+            metrics["batched_images"] / metrics["batches"] if metrics["batches"] else 0.0
+        )
+        metrics["config"] = {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "max_queue_size": self.max_queue_size
+        }
+        return metrics
+
+    def close(self) -> None:
+        """Stop the worker after the queued requests are flushed"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._worker.join()
+
+    def _next_batch(self) -> List[_PendingRequest]:
+        """Wait until a batch is ready and take it off the queue"""
+        with self._cond:
+            while not self._queue and not self._closed:
+                self._cond.wait()
+
+            # Give other requests until the oldest one's deadline to join the batch
+            deadline = self._queue[0].enqueued_at + self.max_wait if self._queue else 0
+            while len(self._queue) < self.max_batch_size and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch = []
+            while self._queue and len(batch) < self.max_batch_size:
+                batch.append(self._queue.popleft())
+            return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                if self._closed:
+                    return
+                continue
+
+            # Skip requests whose caller has already given up
+            batch = [request for request in batch if request.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            try:
+                results = self.predict_batch([request.image for request in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(f"Expected {len(batch)} results, got {len(results)}")
+            except Exception as e:
+                logger.exception(f"Batched inference failed for '{self.model_type}'")
+                with self._cond:
+                    self.metrics["errors"] += 1
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+
+            with self._cond:
+                self.metrics["batches"] += 1
+                self.metrics["batched_images"] += len(batch)
+                self.metrics["max_batch_size_seen"] = max(self.metrics["max_batch_size_seen"], len(batch))
+            for request, result in zip(batch, results):
+                request.future.set_result(result)
+
+_BATCHERS: Dict[str, MicroBatcher] = {}
+_BATCHERS_LOCK = threading.Lock()
+
+def get_batcher(model_type: str) -> MicroBatcher:
+    """
+    Get the shared batcher for a model type, creating it on first use
+
+    Batch size, wait time and queue bound come from the MEDAPI_MAX_BATCH_SIZE,
+    MEDAPI_MAX_BATCH_WAIT_MS and MEDAPI_MAX_QUEUE_SIZE environment variables.
+
+    Args:
+        model_type: The type of model to batch requests for, optionally with
+            a variant suffix
+
+    Returns:
+        The batcher for the requested model
+
+    Raises:
+        ValueError: If the model type or variant is not supported
+    """
+    # Fail fast on unknown models instead of inside the worker thread
+    model_type = format_model_id(*parse_model_id(model_type))
+    with _BATCHERS_LOCK:
+        batcher = _BATCHERS.get(model_type)
+        if batcher is None:
+            batcher = MicroBatcher(
+                model_type,
+                lambda images: get_model(model_type).predict_batch(images),
+                max_batch_size=int(os.environ.get("MEDAPI_MAX_BATCH_SIZE", 8)),
+                max_wait_ms=float(os.environ.get("MEDAPI_MAX_BATCH_WAIT_MS", 10)),
+                max_queue_size=int(os.environ.get("MEDAPI_MAX_QUEUE_SIZE", 64))
+            )
+            _BATCHERS[model_type] = batcher
+        return batcher
+
+def batched_predict(model_type: str, image):
+    """
+    Run inference on one image through the model's micro-batching queue
+
+    Args:
+        model_type: The type of model to run
+        image: The preprocessed image
+
+    Returns:
+        The prediction for the image, in the same format as model.predict
+    """
+    return get_batcher(model_type).predict(image)
+
+def get_batching_metrics() -> Dict[str, Dict[str, Any]]:
+    """Return metrics for every active batcher, keyed by model type"""
+    with _BATCHERS_LOCK:
+        batchers = dict(_BATCHERS)
+    return {model_type: batcher.get_metrics() for model_type, batcher in batchers.items()}
@@ -0,0 +1,171 @@
+"""
+Compare the accuracy and latency of a model's inference variants
+
+Every variant is run over the same images and compared with the fp32 model:
+classification variants by top-1 agreement and confidence drift, detection
+variants by how many fp32 detections they reproduce (same label, IoU >= 0.5).
+
+Usage:
+    python benchmark_variants.py --model medical-classification --images ./samples
+    python benchmark_variants.py --model medical-detection --images ./samples --variants fp32 int8 --json results.json
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import time
+from typing import Any, Dict, List
+
+from PIL import Image
+
+from models import MODEL_VARIANTS, DEFAULT_VARIANT, ModelCache, format_model_id, parse_model_id
+from utils import preprocess_images
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+def load_images(image_dir: str, limit: int = 0) -> List[Image.Image]:
+    """Load every image in a directory, sorted by file name"""
+    names = sorted(name for name in os.listdir(image_dir) if name.lower().endswith(IMAGE_EXTENSIONS))
+    if limit:
+        names = names[:limit]
+    images = []
+    for name in names:
+        with Image.open(os.path.join(image_dir, name)) as image:
+            image.load()
+            images.append(image)
+    return images
+
+def run_variant(cache: ModelCache, model_id: str, batches: List[Dict[str, Any]], repeats: int) -> Dict[str, Any]:
+    """
+    Time a model variant over preprocessed batches
+
+    Returns:
+        The predictions of the first run and the latency of every batch in seconds
+    """
+    model = cache.get(model_id)
+    # One untimed pass so lazy initialization does not count as latency
+    model.predict_batch([batches[0]])
+
+    predictions = []
+    latencies = []
+    for run in range(repeats):
+        for batch in batches:
+            start = time.perf_counter()
+            results = model.predict_batch([batch])
+            latencies.append(time.perf_counter() - start)
+            if run == 0:
+                predictions.extend(results)
+    return {"predictions": predictions, "latencies": latencies}
+
+def _box_iou(a, b) -> float:
+    ix1, iy1 = max(a[0], b[0]), max(a[1], b[1])
+    ix2, iy2 = min(a[2], b[2]), min(a[3], b[3])
+    intersection = max(0.0, ix2 - ix1) * max(0.0, iy2 - iy1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection
+    return intersection / union if union > 0 else 0.0
+
+def compare_classification(reference: List[Dict[str, Any]], candidate: List[Dict[str, Any]]) -> Dict[str, float]:
+    """Top-1 agreement and mean absolute confidence difference against the reference"""
+    agreement = sum(ref["label"] == cand["label"] for ref, cand in zip(reference, candidate))
+    drift = [abs(ref["confidence"] - cand["confidence"]) for ref, cand in zip(reference, candidate)]
+    return {
+        "top1_agreement": agreement / len(reference),
+        "mean_confidence_diff": statistics.fmean(drift)
+    }
+
+def compare_detection(reference: List[Any], candidate: List[Any], iou_threshold: float = 0.5) -> Dict[str, float]:
+    """Precision and recall of the candidate detections, treating the reference as ground truth"""
+    matched = reference_total = candidate_total = 0
+    for ref, cand in zip(reference, candidate):
+        ref, cand = ref[0], cand[0]
+        ref_boxes = list(zip(ref["labels"].tolist(), ref["boxes"].tolist()))
+        cand_boxes = list(zip(cand["labels"].tolist(), cand["boxes"].tolist()))
+        reference_total += len(ref_boxes)
+        candidate_total += len(cand_boxes)
+        for label, box in cand_boxes:
+            for i, (ref_label, ref_box) in enumerate(ref_boxes):
+                if label == ref_label and _box_iou(box, ref_box) >= iou_threshold:
+                    matched += 1
+                    del ref_boxes[i]
+                    break
+    precision = matched / candidate_total if candidate_total else 1.0
+    recall = matched / reference_total if reference_total else 1.0
+    return {"precision_vs_fp32": precision, "recall_vs_fp32": recall}
+
+def benchmark(model_type: str, images: List[Image.Image], variants: List[str],
+              batch_size: int = 8, repeats: int = 3) -> Dict[str, Dict[str, Any]]:
+    """
+    Benchmark the variants of one model on a set of images
+
+    Args:
+        model_type: The model to benchmark, without a variant suffix
+        images: The images to run
+        variants: The variants to compare, fp32 is always included as the reference
+        batch_size: Images per forward pass
+        repeats: Timed passes over the images per variant
+
+    Returns:
+        Latency and accuracy figures keyed by variant
+    """
+    if DEFAULT_VARIANT not in variants:
+        variants = [DEFAULT_VARIANT] + list(variants)
+    batches = [
+        preprocess_images(images[i:i + batch_size], model_type)
+        for i in range(0, len(images), batch_size)
+    ]
+
+    # A cache of its own with every variant enabled, whatever MEDAPI_ENABLED_VARIANTS allows the API
+    cache = ModelCache(max_models=1, variants=MODEL_VARIANTS)
+    runs = {variant: run_variant(cache, format_model_id(model_type, variant), batches, repeats) for variant in variants}
+    reference = runs[DEFAULT_VARIANT]
+
+    report = {}
+    for variant, run in runs.items():
+        latencies = sorted(run["latencies"])
+        per_image_ms = 1000 * sum(latencies) / (len(images) * repeats)
+        entry = {
+            "ms_per_image": per_image_ms,
+            "p50_batch_ms": 1000 * latencies[len(latencies) // 2],
+            "p95_batch_ms": 1000 * latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+            "speedup": 1000 * sum(reference["latencies"]) / (len(images) * repeats) / per_image_ms
+        }
+        if model_type == "medical-classification":
+            entry.update(compare_classification(reference["predictions"], run["predictions"]))
+        else:
+            entry.update(compare_detection(reference["predictions"], run["predictions"]))
+        report[variant] = entry
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare accuracy and latency of model variants")
+    parser.add_argument("--model", required=True, help="Model type, e.g. medical-classification")
+    parser.add_argument("--images", required=True, help="Directory of sample images")
+    parser.add_argument("--variants", nargs="+", default=list(MODEL_VARIANTS), choices=MODEL_VARIANTS)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--limit", type=int, default=0, help="Use at most this many images")
+    parser.add_argument("--json", help="Also write the report to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    model_type, _ = parse_model_id(args.model, variants=MODEL_VARIANTS)
+    images = load_images(args.images, args.limit)
+    if not images:
+        parser.error(f"No images found in {args.images}")
+
+    report = benchmark(model_type, images, args.variants, args.batch_size, args.repeats)
+
+    print(f"{model_type}: {len(images)} images, batch size {args.batch_size}, {args.repeats} repeats")
+    for variant, entry in report.items():
+        figures = ", ".join(f"{key}={value:.3f}" for key, value in entry.items())
+        print(f"  {variant:<8} {figures}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+def hash_upload(stream, model_type: str, chunk_size: int = 1024 * 1024) -> str:
+    """
+    Compute the content address of an upload for a given model
+
+    The stream is read in chunks and rewound afterwards so it can still be
+    decoded.
+
+    Args:
+        stream: A seekable file-like object positioned at the start of the upload
+        model_type: The model the upload will be analyzed with
+        chunk_size: Number of bytes to read at a time
+
+    Returns:
+        A hex SHA-256 digest of the model type and image bytes
+    """
+    digest = hashlib.sha256(model_type.encode("utf-8") + b"\0")
+    for chunk in iter(lambda: stream.read(chunk_size), b""):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+class ResultCache:
+    """
+    Two tier cache of analysis results keyed by content hash
+
+    The memory tier is an LRU bounded by max_entries. When cache_dir is set,
+    results are also written there as JSON files so they survive restarts.
+    Entries in both tiers expire ttl seconds after they were stored.
+    """
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600, cache_dir: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.cache_dir = cache_dir
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "bypassed": 0, "evictions": 0}
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Look up a cached result
+
+        Args:
+            key: The content hash of the upload
+
+        Returns:
+            The cached result, or None if there is no live entry
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if now - stored_at < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return value
+                del self._entries[key]
+
+        entry = self._read_disk(key, now)
+        with self._lock:
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            self.stats["disk_hits"] += 1
+            self._store_memory(key, entry)
+        return entry[1]
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        Store a result in the memory tier and, if enabled, on disk
+
+        Args:
+            key: The content hash of the upload
+            value: A JSON serializable result
+        """
+        entry = (time.time(), value)
+        with self._lock:
+            self._store_memory(key, entry)
+        self._write_disk(key, entry)
+
+    def record_bypass(self) -> None:
+        """Count a request that skipped the cache"""
+        with self._lock:
+            self.stats["bypassed"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return the cache counters and current size"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        stats["disk_enabled"] = bool(self.cache_dir)
+        return stats
+
+    def clear(self) -> None:
+        """Drop every entry from the memory tier"""
+        with self._lock:
+            self._entries.clear()
+
+    def _store_memory(self, key: str, entry) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _read_disk(self, key: str, now: float):
+        if not self.cache_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            logger.warning(f"Discarding unreadable cache entry {path}")
+            self._remove_disk(path)
+            return None
+
+        if now - data["stored_at"] >= self.ttl:
+            self._remove_disk(path)
+            return None
+        return data["stored_at"], data["value"]
+
+    def _write_disk(self, key: str, entry) -> None:
+        if not self.cache_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump({"stored_at": entry[0], "value": entry[1]}, f)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError):
+            logger.exception(f"Failed to write cache entry {path}")
+            self._remove_disk(tmp_path)
+
+    def _remove_disk(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -1,27 +1,185 @@
 import logging
-from typing import Dict, List, Any, Union
+from typing import Dict, List, Any, Union, Optional, Tuple
 import os
 import json
+import threading
+from collections import OrderedDict
+from types import SimpleNamespace
+import torch
 from transformers import AutoProcessor, AutoModelForObjectDetection, AutoModelForImageClassification
 
+from utils import get_preprocessing_config, input_size, pad_batch
+
 logger = logging.getLogger(__name__)
 
+# Inference variants every model can be served as. A variant is selected by
+# appending it to the model id, e.g. "medical-classification:int8", and must be
+# enabled in MEDAPI_ENABLED_VARIANTS (only fp32 by default).
+#   fp32:   the original eager model
+#   int8:   dynamic int8 quantization of the linear layers
+#   traced: a TorchScript graph traced once and cached in MEDAPI_COMPILED_MODEL_DIR
+MODEL_VARIANTS = ("fp32", "int8", "traced")
+DEFAULT_VARIANT = "fp32"
+VARIANT_SEPARATOR = ":"
+
+def _enabled_variants_from_env() -> Tuple[str, ...]:
+    """The comma separated MEDAPI_ENABLED_VARIANTS, the default variant when unset"""
+    names = os.environ.get("MEDAPI_ENABLED_VARIANTS", DEFAULT_VARIANT)
+    variants = tuple(name.strip() for name in names.split(",") if name.strip())
+    unknown = [variant for variant in variants if variant not in MODEL_VARIANTS]
+    if unknown:
+        raise ValueError(f"Unknown variants {unknown} in MEDAPI_ENABLED_VARIANTS. Available variants: {list(MODEL_VARIANTS)}")
+    return variants
+
+# Variants clients may request. Every other variant is refused before anything
+# is loaded, so requests cannot make the server load (or trace) extra models.
+ENABLED_VARIANTS = _enabled_variants_from_env()
+
+COMPILED_MODEL_DIR = os.environ.get(
+    "MEDAPI_COMPILED_MODEL_DIR", os.path.join(os.path.dirname(__file__), "compiled")
+)
+
+class _TracedModelOutputs(torch.nn.Module):
+    """Wraps a Huggingface model so it returns a plain tuple that can be traced"""
+    def __init__(self, model, output_names: Tuple[str, ...]):
+        super().__init__()
+        self.model = model
+        self.output_names = output_names
+    
+    def forward(self, pixel_values, pixel_mask=None):
+        if pixel_mask is None:
+            outputs = self.model(pixel_values=pixel_values)
+        else:
+            outputs = self.model(pixel_values=pixel_values, pixel_mask=pixel_mask)
+        return tuple(getattr(outputs, name) for name in self.output_names)
+
+class _ScriptedModel:
+    """Calls a TorchScript module like the Huggingface model it was traced from"""
+    def __init__(self, module, output_names: Tuple[str, ...]):
+        self.module = module
+        self.output_names = output_names
+    
+    def __call__(self, pixel_values, pixel_mask=None):
+        if pixel_mask is None:
+            outputs = self.module(pixel_values)
+        else:
+            outputs = self.module(pixel_values, pixel_mask)
+        return SimpleNamespace(**dict(zip(self.output_names, outputs)))
+
 # Mock models and implementations
 # In a real application, these would use actual Huggingface models
 
 class BaseMedicalModel:
     """Base class for all medical image models"""
+    # Model outputs used by predict_batch, kept when the model is traced
+    output_names: Tuple[str, ...] = ("logits",)
+    # Whether the model takes the pixel_mask of padded batches
+    uses_pixel_mask = False
+    
     def __init__(self, name: str, model_type: str):
         self.name = name
         self.model_type = model_type
+        self.variant = DEFAULT_VARIANT
+        # The (width, height) every batch is padded to, set for traced graphs
+        self.fixed_input_size = None
         logger.info(f"Initialized {model_type} model: {name}")
     
+    def apply_variant(self, variant: str, model_id: str) -> None:
+        """
+        Convert the loaded model into an optimized inference variant
+        
+        Args:
+            variant: One of MODEL_VARIANTS
+            model_id: The registry id of the model, used to find its
+                preprocessing config and name the traced graph on disk
+        """
+        if variant == DEFAULT_VARIANT:
+            return
+        
+        self.model.eval()
+        if variant == "int8":
+            self.model = torch.ao.quantization.quantize_dynamic(
+                self.model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+        elif variant == "traced":
+            self.model = _ScriptedModel(self._load_traced(model_id), self.output_names)
+            self.fixed_input_size = input_size(get_preprocessing_config(model_id))
+        else:
+            raise ValueError(f"Unsupported model variant '{variant}'. Available variants: {list(MODEL_VARIANTS)}")
+        self.variant = variant
+        logger.info(f"Converted {self.name} to the {variant} variant")
+    
+    def _load_traced(self, model_id: str):
+        """Load the cached TorchScript graph for this model, tracing it on first use"""
+        width, height = input_size(get_preprocessing_config(model_id))
+        path = os.path.join(
+            COMPILED_MODEL_DIR,
+            f"{model_id}-{height}x{width}-torch{torch.__version__.replace('+', '_')}.pt"
+        )
+        if os.path.exists(path):
+            logger.info(f"Loading traced model from {path}")
+            return torch.jit.load(path)
+        
+        logger.info(f"Tracing {self.name}, this only happens once per input size")
+        # Trace with a batch of two so the batch dimension is not specialized
+        example = (torch.zeros(2, 3, height, width),)
+        if self.uses_pixel_mask:
+            example += (torch.ones(2, height, width, dtype=torch.long),)
+        with torch.no_grad():
+            traced = torch.jit.trace(_TracedModelOutputs(self.model, self.output_names).eval(), example)
+        traced = torch.jit.freeze(traced)
+        
+        os.makedirs(COMPILED_MODEL_DIR, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        torch.jit.save(traced, tmp_path)
+        os.replace(tmp_path, path)
+        return traced
+    
     def predict(self, image):
         """Base prediction method to be implemented by subclasses"""
         raise NotImplementedError("Subclasses must implement predict method")
+    
+    def predict_batch(self, images: List[Any]) -> List[Any]:
+        """
+        Run prediction on several images
+        
+        Subclasses override this with a single batched forward pass; the
+        default falls back to one predict call per image.
+        
+        Args:
+            images: The preprocessed input images
+            
+        Returns:
+            One prediction per input image, in the same order
+        """
+        return [self.predict(image) for image in images]
+    
+    def _collate(self, images: List[Dict[str, Any]]):
+        """
+        Concatenate preprocessed inputs into one pixel_values batch
+
+        Inputs of different sizes are zero padded to the largest one, or to
+        the fixed input size the traced graph was built for.
+
+        Returns:
+            The pixel values, their pixel mask (None when nothing is padded)
+            and the original image sizes
+        """
+        original_sizes = [size for image in images for size in image["original_sizes"]]
+        pixel_values = [image["pixel_values"] for image in images]
+        pixel_masks = [image.get("pixel_mask") for image in images]
+        size = self.fixed_input_size
+        if size is None and all(mask is None for mask in pixel_masks) and \
+                len({values.shape[-2:] for values in pixel_values}) == 1:
+            return torch.cat(pixel_values), None, original_sizes
+        pixel_values, pixel_mask = pad_batch(pixel_values, pixel_masks, size)
+        return pixel_values, pixel_mask, original_sizes
 
 class MedicalDetectionModel(BaseMedicalModel):
     """Model for medical object detection"""
+    output_names = ("logits", "pred_boxes")
+    uses_pixel_mask = True
+    
     def __init__(self, name: str = "medical-detection-model"):
         super().__init__(name, "detection")
         # In a real implementation, this would load the model from Huggingface
@@ -34,16 +192,14 @@ class MedicalDetectionModel(BaseMedicalModel):
         """
         Predict medical objects in an image
         
-        In a real implementation, this would use:
-        inputs = self.processor(images=image, return_tensors="pt")
-        outputs = self.model(**inputs)
-        results = self.processor.post_process_object_detection(outputs)
+        Args:
+            image: Model inputs from utils.preprocess_image
+        
+        Returns:
+            A one element list with the detections for the image, with boxes
+            in the original image's pixel coordinates
         """
-        logger.info(f"Running detection on image of size {image.size}")
-        inputs = self.processor(images=image, return_tensors="pt")
-        outputs = self.model(**inputs)
-        results = self.processor.post_process_object_detection(outputs, target_sizes=[image.size[::-1]])
-        return results
+        return self.predict_batch([image])[0]
         # Mock implementation for demonstration
         logger.info(f"Running detection on image of size {image.size}")
         
@@ -62,37 +218,33 @@ class MedicalDetectionModel(BaseMedicalModel):
             }
         ]
 
+    def predict_batch(self, images):
+        """Detect medical objects in several images with one forward pass"""
+        pixel_values, pixel_mask, original_sizes = self._collate(images)
+        logger.info(f"Running detection on {len(original_sizes)} images of size {tuple(pixel_values.shape[-2:])}")
+        with torch.no_grad():
+            outputs = self.model(pixel_values=pixel_values, pixel_mask=pixel_mask)
+        results = self.processor.post_process_object_detection(outputs, target_sizes=original_sizes)
+        # Keep the single-image output shape: a one element list per image
+        return [[result] for result in results]
+
 class MedicalClassificationModel(BaseMedicalModel):
     """Model for medical image classification"""
     def __init__(self, name: str = "medical-classification-model"):
         super().__init__(name, "classification")
         self.model = AutoModelForImageClassification.from_pretrained("nickmuchi/vit-finetuned-chest-xray-pneumonia")
-        self.processor = AutoProcessor.from_pretrained("nickmuchi/vit-finetuned-chest-xray-pneumonia")
         self.label_mapping = self.model.config.id2label if hasattr(self.model.config, "id2label") else None
     def predict(self, image):
         """
         Classify a medical image
         
-        In a real implementation, this would use:
-        inputs = self.processor(images=image, return_tensors="pt")
-        outputs = self.model(**inputs)
-        probabilities = outputs.logits.softmax(dim=1)
-        """
-        # Mock implementation for demonstration
-        logger.info(f"Running classification on image of size {image.size}")
-        inputs = self.processor(images=image, return_tensors="pt")
-        outputs = self.model(**inputs)
-        probabilities = outputs.logits.softmax(dim=1)
-        # Get the class with the highest probability
-        max_prob, predicted_class = probabilities.max(dim=1)
-        
-        # Map the class index to a human-readable label if available
-        label = self.label_mapping[predicted_class.item()] if self.label_mapping else predicted_class.item()
+        Args:
+            image: Model inputs from utils.preprocess_image
         
-        return {
-            "label": label,
-            "confidence": max_prob.item()
-        }
+        Returns:
+            The most likely label and its probability
+        """
+        return self.predict_batch([image])[0]
         # Simulate classification results
         # In a real model, these would be actual predictions
         return [
@@ -106,16 +258,169 @@ class MedicalClassificationModel(BaseMedicalModel):
             }
         ]
 
+    def predict_batch(self, images):
+        """Classify several medical images with one forward pass"""
+        pixel_values, _, original_sizes = self._collate(images)
+        logger.info(f"Running classification on {len(original_sizes)} images of size {tuple(pixel_values.shape[-2:])}")
+        with torch.no_grad():
+            outputs = self.model(pixel_values=pixel_values)
+        probabilities = outputs.logits.softmax(dim=1)
+        # Get the class with the highest probability
+        max_probs, predicted_classes = probabilities.max(dim=1)
+
+        results = []
+        for max_prob, predicted_class in zip(max_probs.tolist(), predicted_classes.tolist()):
+            # Map the class index to a human-readable label if available
+            label = self.label_mapping[predicted_class] if self.label_mapping else predicted_class
+            results.append({
+                "label": label,
+                "confidence": max_prob
+            })
+        return results
+
 # Model registry to keep track of available models
 _MODEL_REGISTRY = {
     "medical-detection": MedicalDetectionModel,
     "medical-classification": MedicalClassificationModel
 }
 
+class ModelCache:
+    """
+    Process-wide cache of loaded model instances
+    
+    Each model is loaded once on first use and shared by every request.
+    Entries are keyed by model id, so every variant of a model is cached
+    separately.
+    Loading is serialized per model type so concurrent requests for a cold
+    model wait for a single from_pretrained call instead of racing. At most
+    max_models instances are kept resident; the least recently used one is
+    evicted when the bound is exceeded. Only the given variants are served,
+    ENABLED_VARIANTS by default.
+    """
+    def __init__(self, registry: Optional[Dict[str, type]] = None, max_models: int = 2,
+                 variants: Optional[Tuple[str, ...]] = None):
+        if max_models < 1:
+            raise ValueError("max_models must be at least 1")
+        self.registry = _MODEL_REGISTRY if registry is None else registry
+        self.max_models = max_models
+        self.variants = ENABLED_VARIANTS if variants is None else tuple(variants)
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+    
+    def get(self, model_type: str) -> BaseMedicalModel:
+        """
+        Get the shared instance for a model type, loading it if needed
+        
+        Args:
+            model_type: The type of model to get, optionally with a variant
+                suffix such as "medical-classification:int8"
+            
+        Returns:
+            The shared instance of the requested model
+            
+        Raises:
+            ValueError: If the model type or variant is not supported
+        """
+        base_type, variant = parse_model_id(model_type, self.registry, self.variants)
+        model_type = format_model_id(base_type, variant)
+        
+        with self._lock:
+            model = self._models.get(model_type)
+            if model is not None:
+                self._models.move_to_end(model_type)
+                self.stats["hits"] += 1
+                return model
+            load_lock = self._load_locks.setdefault(model_type, threading.Lock())
+        
+        with load_lock:
+            # Another thread may have finished loading while we waited
+            with self._lock:
+                model = self._models.get(model_type)
+                if model is not None:
+                    self._models.move_to_end(model_type)
+                    self.stats["hits"] += 1
+                    return model
+            
+            logger.info(f"Loading model '{model_type}' into cache")
+            model = self.registry[base_type]()
+            model.apply_variant(variant, base_type)
+            
+            with self._lock:
+                self.stats["misses"] += 1
+                self._models[model_type] = model
+                while len(self._models) > self.max_models:
+                    evicted, _ = self._models.popitem(last=False)
+                    self.stats["evictions"] += 1
+                    logger.info(f"Evicted model '{evicted}' from cache")
+            return model
+    
+    def warm_up(self, model_types: Optional[List[str]] = None) -> None:
+        """
+        Eagerly load models so the first request does not pay the load cost
+        
+        Args:
+            model_types: The model types to load, defaults to every registered type
+        """
+        for model_type in model_types or list(self.registry.keys()):
+            self.get(model_type)
+    
+    def loaded_models(self) -> List[str]:
+        """Return the currently resident model types, least recently used first"""
+        with self._lock:
+            return list(self._models.keys())
+    
+    def clear(self) -> None:
+        """Drop every cached model instance"""
+        with self._lock:
+            self._models.clear()
+
+def format_model_id(model_type: str, variant: str = DEFAULT_VARIANT) -> str:
+    """Build the id of a model variant, the plain model type for the default variant"""
+    return model_type if variant == DEFAULT_VARIANT else f"{model_type}{VARIANT_SEPARATOR}{variant}"
+
+def parse_model_id(model_id: str, registry: Optional[Dict[str, type]] = None,
+                   variants: Optional[Tuple[str, ...]] = None) -> Tuple[str, str]:
+    """
+    Split a model id into its model type and inference variant
+    
+    Args:
+        model_id: A model type, optionally followed by ":<variant>"
+        registry: The registry to validate the model type against
+        variants: The variants to accept, ENABLED_VARIANTS by default
+        
+    Returns:
+        The model type and the variant
+        
+    Raises:
+        ValueError: If the model type or variant is not supported or not enabled
+    """
+    registry = _MODEL_REGISTRY if registry is None else registry
+    variants = ENABLED_VARIANTS if variants is None else variants
+    model_type, _, variant = model_id.partition(VARIANT_SEPARATOR)
+    variant = variant or DEFAULT_VARIANT
+    if model_type not in registry:
+        raise ValueError(f"Model type '{model_type}' not supported. Available types: {list(registry.keys())}")
+    if variant not in MODEL_VARIANTS:
+        raise ValueError(f"Model variant '{variant}' not supported. Available variants: {list(MODEL_VARIANTS)}")
+    if variant not in variants:
+        raise ValueError(f"Model variant '{variant}' is not enabled. Enabled variants: {list(variants)}")
+    return model_type, variant
+
+# By default every enabled variant of every model fits, so variant requests
+# never evict the warmed up models
+_MODEL_CACHE = ModelCache(
+    _MODEL_REGISTRY,
+    max_models=int(os.environ.get("MEDAPI_MAX_LOADED_MODELS", len(_MODEL_REGISTRY) * len(ENABLED_VARIANTS)))
+)
+
 def get_model(model_type: str) -> BaseMedicalModel:
     """
     Get a model instance by type
     
+    Instances are shared across requests through the process-wide model cache.
+    
     Args:
         model_type: The type of model to get
         
@@ -125,16 +430,33 @@ def get_model(model_type: str) -> BaseMedicalModel:
     Raises:
         ValueError: If the model type is not supported
     """
-    if model_type not in _MODEL_REGISTRY:
-        raise ValueError(f"Model type '{model_type}' not supported. Available types: {list(_MODEL_REGISTRY.keys())}")
+    return _MODEL_CACHE.get(model_type)
+
+def warm_up_models(model_types: Optional[List[str]] = None) -> None:
+    """
+    Load models into the cache ahead of the first request
     
-    # Return an instance of the requested model
-    return _MODEL_REGISTRY[model_type]()
+    Args:
+        model_types: The model types to load. When omitted, the comma separated
+            MEDAPI_WARMUP_MODELS environment variable is used, and if that is
+            unset every registered model is loaded.
+    """
+    if model_types is None:
+        env_models = os.environ.get("MEDAPI_WARMUP_MODELS")
+        if env_models is not None:
+            model_types = [m.strip() for m in env_models.split(",") if m.strip()]
+            if not model_types:
+                logger.info("Model warm-up disabled")
+                return
+    logger.info(f"Warming up models: {model_types or list(_MODEL_REGISTRY.keys())}")
+    _MODEL_CACHE.warm_up(model_types)
 
 def list_available_models() -> List[Dict[str, str]]:
     """
     List all available models
     
+    Each model can be requested as "<id>:<variant>" for any enabled variant.
+    
     Returns:
         A list of dictionaries containing information about available models
     """
@@ -144,14 +466,16 @@ def list_available_models() -> List[Dict[str, str]]:
             "name": "Medical Object Detection",
             "description": "Detects medical conditions and anomalies in images",
             "type": "detection",
-            "source": "huggingface"
+            "source": "huggingface",
+            "variants": list(ENABLED_VARIANTS)
         },
         {
             "id": "medical-classification",
             "name": "Medical Image Classification",
             "description": "Classifies medical images into categories",
             "type": "classification",
-            "source": "huggingface"
+            "source": "huggingface",
+            "variants": list(ENABLED_VARIANTS)
         }
     ]
 
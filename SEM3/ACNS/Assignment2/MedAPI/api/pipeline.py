@@ -0,0 +1,107 @@
+import os
+import json
+import logging
+from typing import Any, Optional, Tuple
+
+from utils import preprocess_image, format_results, load_uploaded_image
+from cache import ResultCache, hash_upload
+from models import parse_model_id
+
+logger = logging.getLogger(__name__)
+
+# Shared request handling steps for the WSGI (app.py) and ASGI (asgi.py) servers
+
+# Configure upload folder
+UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), 'uploads')
+os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max upload
+# Uploads larger than this are spilled to UPLOAD_FOLDER instead of decoded in memory
+UPLOAD_SPILL_THRESHOLD = int(os.environ.get('MEDAPI_UPLOAD_SPILL_THRESHOLD', 8 * 1024 * 1024))
+
+# Allowed file extensions
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+
+# Cache analysis results by image content so re-submitted studies skip inference
+result_cache = ResultCache(
+    max_entries=int(os.environ.get('MEDAPI_RESULT_CACHE_SIZE', 1024)),
+    ttl=float(os.environ.get('MEDAPI_RESULT_CACHE_TTL', 3600)),
+    cache_dir=os.environ.get('MEDAPI_RESULT_CACHE_DIR') or None
+)
+
+# Requests with this header set to a true value skip the result cache
+CACHE_BYPASS_HEADER = 'X-Cache-Bypass'
+
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+def cache_bypass_requested(headers) -> bool:
+    """Check whether the request asked to skip the result cache"""
+    return headers.get(CACHE_BYPASS_HEADER, '').lower() in ('1', 'true', 'yes')
+
+def lookup_cached_results(stream, model_type: str, bypass_cache: bool) -> Tuple[str, Optional[Any]]:
+    """
+    Hash an upload and look it up in the result cache
+
+    Args:
+        stream: The upload stream, rewound after hashing
+        model_type: The model id the upload will be analyzed with
+        bypass_cache: Skip the lookup and only compute the key
+
+    Returns:
+        The cache key and the cached results, or None on a miss or bypass
+    """
+    cache_key = hash_upload(stream, model_type)
+    if bypass_cache:
+        result_cache.record_bypass()
+        return cache_key, None
+    return cache_key, result_cache.get(cache_key)
+
+def prepare_image(stream, filename: str, model_type: str):
+    """
+    Decode and preprocess an upload for inference
+
+    Args:
+        stream: The upload stream
+        filename: The client supplied filename, used for logging only
+        model_type: The model id the image will be analyzed with
+
+    Returns:
+        The preprocessed image
+    """
+    base_type, _ = parse_model_id(model_type)
+    # Decode the upload in memory, spilling only large files to disk
+    image = load_uploaded_image(
+        stream,
+        spill_threshold=UPLOAD_SPILL_THRESHOLD,
+        spill_dir=UPLOAD_FOLDER
+    )
+    logger.info(f"Decoded upload {filename} ({image.size[0]}x{image.size[1]})")
+
+    return preprocess_image(image, base_type)
+
+def finalize_results(results, model_type: str, cache_key: str):
+    """
+    Build the response results for a prediction and store them in the cache
+
+    Args:
+        results: The raw prediction from the model
+        model_type: The model id that produced the prediction
+        cache_key: The content hash of the upload
+
+    Returns:
+        The value for the response's results field
+    """
+    base_type, _ = parse_model_id(model_type)
+    # Format the results
+    formatted_results = format_results(results, base_type)
+    # Log the results
+    logger.info(f"Results: {json.dumps(formatted_results, indent=2)}")
+
+    if(base_type == "medical-classification"):
+        response_results = results
+    elif(base_type == "medical-detection"):
+        response_results = formatted_results
+
+    # Cache what the client receives so a hit returns an identical payload
+    result_cache.set(cache_key, response_results)
+    return response_results
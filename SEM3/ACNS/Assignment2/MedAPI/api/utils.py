@@ -4,6 +4,10 @@ import sys
 from typing import List, Dict, Any, Union
 from PIL import Image
 import io
+import shutil
+import tempfile
+import json
+import numpy as np
 import torch
 
 def setup_logging():
@@ -33,34 +37,169 @@ def setup_logging():
     logger.addHandler(console_handler)
     logger.addHandler(file_handler)
 
-def preprocess_image(image: Image.Image, model_type: str) -> Image.Image:
+def load_uploaded_image(stream, spill_threshold: int = 8 * 1024 * 1024, spill_dir: str = None) -> Image.Image:
     """
-    Preprocess an image for a specific model type
+    Decode an uploaded image without a save-then-reopen round trip
+    
+    Uploads up to spill_threshold bytes are decoded straight from memory. Larger
+    uploads are spilled to a uniquely named temporary file, which is removed as
+    soon as the image has been decoded.
     
     Args:
-        image: The input image
+        stream: A file-like object positioned at the start of the upload
+        spill_threshold: Largest upload in bytes that is decoded in memory
+        spill_dir: Directory for spilled uploads, defaults to the system temp dir
+        
+    Returns:
+        The fully loaded image
+    """
+    head = stream.read(spill_threshold + 1)
+    
+    if len(head) <= spill_threshold:
+        image = Image.open(io.BytesIO(head))
+        image.load()
+        return image
+    
+    logging.info(f"Upload larger than {spill_threshold} bytes, spilling to disk")
+    with tempfile.TemporaryFile(dir=spill_dir) as spill_file:
+        spill_file.write(head)
+        del head
+        shutil.copyfileobj(stream, spill_file)
+        spill_file.seek(0)
+        image = Image.open(spill_file)
+        image.load()
+    return image
+
+def aspect_preserving_size(width: int, height: int, shortest_edge: int, longest_edge: int = None) -> tuple:
+    """
+    The (width, height) an image is resized to so that its shorter side is
+    shortest_edge, unless that makes the longer side exceed longest_edge
+    """
+    short, long = min(width, height), max(width, height)
+    size = shortest_edge
+    if longest_edge is not None and long * size / short > longest_edge:
+        size = int(round(longest_edge * short / long))
+    if width <= height:
+        return size, int(size * height / width)
+    return int(size * width / height), size
+
+def input_size(params: Dict[str, Any]) -> tuple:
+    """
+    The largest (width, height) the preprocessing can produce, the fixed input
+    size of models that cannot take variable sized batches
+    """
+    if 'resize' in params:
+        return tuple(params['resize'])
+    edge = params.get('longest_edge', params['shortest_edge'])
+    return edge, edge
+
+def pad_batch(pixel_values: List[torch.Tensor], pixel_masks: List[torch.Tensor] = None, size: tuple = None):
+    """
+    Concatenate (batch, channels, height, width) tensors, zero padding them at
+    the bottom and right to a common size
+
+    Args:
+        pixel_values: The tensors to concatenate
+        pixel_masks: Their (batch, height, width) masks of valid pixels, or
+            None when every pixel is valid
+        size: The (width, height) to pad to, the largest input when None
+
+    Returns:
+        The batch and its pixel mask, 1 for image pixels and 0 for padding
+    """
+    if size is None:
+        width = max(values.shape[-1] for values in pixel_values)
+        height = max(values.shape[-2] for values in pixel_values)
+    else:
+        width, height = size
+    total = sum(values.shape[0] for values in pixel_values)
+    batch = torch.zeros((total, pixel_values[0].shape[1], height, width), dtype=pixel_values[0].dtype)
+    mask = torch.zeros((total, height, width), dtype=torch.long)
+    row = 0
+    for i, values in enumerate(pixel_values):
+        n, _, h, w = values.shape
+        batch[row:row + n, :, :h, :w] = values
+        if pixel_masks is None or pixel_masks[i] is None:
+            mask[row:row + n, :h, :w] = 1
+        else:
+            mask[row:row + n, :h, :w] = pixel_masks[i]
+        row += n
+    return batch, mask
+
+def preprocess_images(images: List[Image.Image], model_type: str) -> Dict[str, Any]:
+    """
+    Turn images into a model-ready batch in a single pass
+    
+    Each image is converted to RGB and resized once, then rescaled and
+    normalized with NumPy. With a fixed 'resize' every image gets the model's
+    input size. With 'shortest_edge' (and optionally 'longest_edge') the
+    aspect ratio is kept, as the DETR image processor does, and the batch is
+    zero padded to its largest image. The parameters come from
+    load_model_config, so no further processor call is needed before
+    inference.
+    
+    Args:
+        images: The input images
         model_type: The type of model to preprocess for
         
     Returns:
-        The preprocessed image
+        A dictionary with a float32 pixel_values tensor of shape
+        (batch, channels, height, width), the original (height, width) of
+        each image under original_sizes and, for aspect preserving resizes,
+        the pixel_mask of the padded batch
     """
-    # Common preprocessing steps
-    # Convert to RGB if not already
-    if image.mode != 'RGB':
-        image = image.convert('RGB')
+    params = get_preprocessing_config(model_type)
+    fixed_size = tuple(params['resize']) if 'resize' in params else None
     
-    # Model-specific preprocessing
-    if model_type == 'medical-detection':
-        # For detection, we might resize to a specific size
-        image = image.resize((512, 512))
-    elif model_type == 'medical-classification':
-        # For classification, we might use a different size
-        image = image.resize((299, 299))
+    arrays = []
+    original_sizes = []
+    for image in images:
+        original_sizes.append((image.size[1], image.size[0]))
+        # Convert to RGB if not already
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        size = fixed_size or aspect_preserving_size(
+            image.size[0], image.size[1], params['shortest_edge'], params.get('longest_edge')
+        )
+        if image.size != size:
+            image = image.resize(size, Image.BILINEAR)
+        arrays.append(np.asarray(image, dtype=np.float32))
     
-    # In a real implementation, we would apply more preprocessing
-    # such as normalization based on the model's requirements
+    mean = np.asarray(params['mean'], dtype=np.float32)
+    std = np.asarray(params['std'], dtype=np.float32)
+    def normalize(batch):
+        batch *= params['rescale_factor']
+        if params['normalize']:
+            batch -= mean
+            batch /= std
+        return torch.from_numpy(np.ascontiguousarray(batch.transpose(0, 3, 1, 2)))
     
-    return image
+    if fixed_size is not None:
+        return {
+            'pixel_values': normalize(np.stack(arrays)),
+            'original_sizes': original_sizes
+        }
+    
+    # Padding is added after normalization so it stays zero, as in DETR
+    pixel_values, pixel_mask = pad_batch([normalize(array[np.newaxis]) for array in arrays])
+    return {
+        'pixel_values': pixel_values,
+        'pixel_mask': pixel_mask,
+        'original_sizes': original_sizes
+    }
+
+def preprocess_image(image: Image.Image, model_type: str) -> Dict[str, Any]:
+    """
+    Preprocess an image for a specific model type
+    
+    Args:
+        image: The input image
+        model_type: The type of model to preprocess for
+        
+    Returns:
+        The model inputs for a batch of one, see preprocess_images
+    """
+    return preprocess_images([image], model_type)
 
 def format_results(results: List[Dict[str, Any]], model_type: str) -> List[Dict[str, Any]]:
     """
@@ -129,6 +268,36 @@ def save_image_for_debugging(image: Image.Image, filename: str) -> str:
     
     return filepath
 
+# Preprocessing defaults matching the image processors the models were trained with
+_DEFAULT_PREPROCESSING = {
+    'medical-detection': {
+        # DETR keeps the aspect ratio: shorter side 800, longer side at most 1333
+        'shortest_edge': 800,
+        'longest_edge': 1333,
+        'normalize': True,
+        'rescale_factor': 1 / 255,
+        'mean': [0.485, 0.456, 0.406],
+        'std': [0.229, 0.224, 0.225]
+    },
+    'medical-classification': {
+        'resize': [224, 224],
+        'normalize': True,
+        'rescale_factor': 1 / 255,
+        'mean': [0.5, 0.5, 0.5],
+        'std': [0.5, 0.5, 0.5]
+    }
+}
+
+_GENERIC_PREPROCESSING = {
+    'resize': [512, 512],
+    'normalize': True,
+    'rescale_factor': 1 / 255,
+    'mean': [0.5, 0.5, 0.5],
+    'std': [0.5, 0.5, 0.5]
+}
+
+_CONFIG_CACHE: Dict[str, Dict[str, Any]] = {}
+
 def load_model_config(model_type: str) -> Dict[str, Any]:
     """
     Load configuration for a specific model type
@@ -149,19 +318,40 @@ def load_model_config(model_type: str) -> Dict[str, Any]:
         default_config = {
             'name': f"{model_type}-default",
             'huggingface_model': None,
-            'preprocessing': {
-                'resize': [512, 512],
-                'normalize': True
-            }
+            'preprocessing': dict(_DEFAULT_PREPROCESSING.get(model_type, _GENERIC_PREPROCESSING))
         }
         
         with open(config_file, 'w') as f:
-            import json
             json.dump(default_config, f, indent=2)
         
         return default_config
     
     # Load existing config
     with open(config_file, 'r') as f:
-        import json
-        return json.load(f)
\ No newline at end of file
+        return json.load(f)
+
+def get_preprocessing_config(model_type: str) -> Dict[str, Any]:
+    """
+    Get the preprocessing parameters for a model type
+    
+    The model config is read once per process. Keys missing from the config
+    file fall back to the model's defaults.
+    
+    Args:
+        model_type: The type of model to get preprocessing parameters for
+        
+    Returns:
+        The preprocessing parameters
+        
+    Raises:
+        ValueError: If the model type is not supported
+    """
+    params = _CONFIG_CACHE.get(model_type)
+    if params is None:
+        # Model types come from requests, never use unknown ones as file names
+        if model_type not in _DEFAULT_PREPROCESSING:
+            raise ValueError(f"Model type '{model_type}' not supported. Available types: {list(_DEFAULT_PREPROCESSING.keys())}")
+        params = dict(_DEFAULT_PREPROCESSING[model_type])
+        params.update(load_model_config(model_type).get('preprocessing', {}))
+        _CONFIG_CACHE[model_type] = params
+    return params
@@ -0,0 +1,80 @@
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from batching import QueueFullError
+
+logger = logging.getLogger(__name__)
+
+class BoundedExecutor:
+    """
+    Thread pool that rejects work instead of queueing without limit
+
+    At most max_workers tasks run at once and up to max_queue more may wait.
+    Submitting beyond that raises QueueFullError so the server can answer 503
+    rather than letting latency grow without bound.
+    """
+    def __init__(self, max_workers: int, max_queue: int = 0, name: str = "medapi-worker"):
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.stats = {"submitted": 0, "rejected": 0}
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """
+        Schedule fn(*args, **kwargs) on the pool
+
+        Raises:
+            QueueFullError: If every worker is busy and the queue is full
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.stats["rejected"] += 1
+            raise QueueFullError("Inference worker pool is saturated")
+
+        with self._lock:
+            self._in_flight += 1
+            self.stats["submitted"] += 1
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: self._release())
+        return future
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return pool counters and the number of tasks running or queued"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["in_flight"] = self._in_flight
+        stats["max_workers"] = self.max_workers
+        stats["max_queue"] = self.max_queue
+        return stats
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
+
+    def _release(self) -> None:
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+def create_worker_pool() -> BoundedExecutor:
+    """
+    Create a worker pool sized from the environment
+
+    MEDAPI_WORKER_THREADS defaults to the number of CPU cores and
+    MEDAPI_WORKER_QUEUE to twice that.
+    """
+    max_workers = int(os.environ.get("MEDAPI_WORKER_THREADS", os.cpu_count() or 1))
+    max_queue = int(os.environ.get("MEDAPI_WORKER_QUEUE", 2 * max_workers))
+    logger.info(f"Starting worker pool with {max_workers} threads and queue of {max_queue}")
+    return BoundedExecutor(max_workers, max_queue)
@@ -12,39 +12,177 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+# Writes a psql script to stdout that upserts the products of products.json
+# into the catalog table, keyed by id. Rows whose values did not change are
+# left alone, and rows whose description changed get their embedding cleared
+# so that only those are embedded again.
+#
+#   python3 generate_sql_from_products.py [products.json] [--format copy|insert]
+
+import argparse
 import json
+import sys
 
-table_name = "catalog_items"
 fields = [
-    'id', 'name', 'description', 'picture', 
-    'price_usd_currency_code', 'price_usd_units', 'price_usd_nanos', 
+    'id', 'name', 'description', 'picture',
+    'price_usd_currency_code', 'price_usd_units', 'price_usd_nanos',
     'categories'
 ]
 
-# Load the produts JSON
-with open("products.json", 'r') as f:
-    data = json.load(f)
+def iter_products(f, chunk_size=1 << 16):
+    """Yield the objects of the top level "products" array of a JSON file one
+    at a time, reading the file in chunks instead of loading all of it."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    eof = False
 
-# Generate SQL INSERT statements
-for product in data['products']:
-    columns = ', '.join(fields)
-    placeholders = ', '.join(['{}'] * len(fields))
-    sql = f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders});"
-
-    # Escape single quotes within product data 
-    product['name'] = product['name'].replace("'", "")
-    product['description'] = product['description'].replace("'", "")
-
-    escaped_values = (
-        f"'{product['id']}'",
-        f"'{product['name']}'",
-        f"'{product['description']}'",
-        f"'{product['picture']}'",
-        f"'{product['priceUsd']['currencyCode']}'",
-        product['priceUsd']['units'],
-        product['priceUsd']['nanos'],
-        f"'{','.join(product['categories'])}'"
+    def fill():
+        nonlocal buffer, pos, eof
+        chunk = f.read(chunk_size)
+        if not chunk:
+            eof = True
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+    def skip_whitespace():
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n':
+                pos += 1
+            if pos < len(buffer) or eof:
+                return
+            fill()
+
+    # find the start of the products array
+    key = '"products"'
+    while True:
+        start = buffer.find(key, pos)
+        if start >= 0:
+            pos = start + len(key)
+            break
+        if eof:
+            raise ValueError('no "products" array in the input')
+        pos = max(0, len(buffer) - len(key))
+        fill()
+    skip_whitespace()
+    if buffer[pos:pos + 1] != ':':
+        raise ValueError('expected ":" after "products"')
+    pos += 1
+    skip_whitespace()
+    if buffer[pos:pos + 1] != '[':
+        raise ValueError('"products" is not an array')
+    pos += 1
+
+    while True:
+        skip_whitespace()
+        if buffer[pos:pos + 1] == ']':
+            return
+        while True:
+            try:
+                product, end = decoder.raw_decode(buffer, pos)
+                break
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                fill()
+        pos = end
+        yield product
+        skip_whitespace()
+        if buffer[pos:pos + 1] == ',':
+            pos += 1
+        elif buffer[pos:pos + 1] != ']':
+            raise ValueError('expected "," or "]" after a product')
+
+def product_row(product):
+    return (
+        product['id'],
+        product['name'],
+        product['description'],
+        product['picture'],
+        product['priceUsd']['currencyCode'],
+        int(product['priceUsd'].get('units', 0)),
+        int(product['priceUsd'].get('nanos', 0)),
+        ','.join(product['categories']),
     )
 
-    # Render the formatted SQL query
-    print(sql.format(*escaped_values))
+def sql_literal(value):
+    if value is None:
+        return 'NULL'
+    if isinstance(value, int):
+        return str(value)
+    return "'" + value.replace("'", "''") + "'"
+
+def copy_field(value):
+    """A field in the text format of COPY."""
+    if value is None:
+        return '\\N'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+def upsert_clause(table_name):
+    updated = [field for field in fields if field != 'id']
+    assignments = [f"{field} = EXCLUDED.{field}" for field in updated]
+    # the embedding is computed from the description, clear it when that changes
+    assignments.append(
+        f"product_embedding = CASE WHEN {table_name}.description IS DISTINCT FROM EXCLUDED.description "
+        f"THEN NULL ELSE {table_name}.product_embedding END")
+    current = ', '.join(f"{table_name}.{field}" for field in updated)
+    excluded = ', '.join(f"EXCLUDED.{field}" for field in updated)
+    return (f"ON CONFLICT (id) DO UPDATE SET {', '.join(assignments)} "
+            f"WHERE ({current}) IS DISTINCT FROM ({excluded})")
+
+def write_inserts(products, table_name, batch_size, out):
+    """One multi-row INSERT ... ON CONFLICT per batch_size products."""
+    columns = ', '.join(fields)
+    batch = []
+
+    def flush():
+        # a statement cannot update the same row twice, keep the last copy of an id
+        rows = {row[0]: row for row in batch}.values()
+        values = ',\n'.join('(' + ', '.join(sql_literal(value) for value in row) + ')' for row in rows)
+        out.write(f"INSERT INTO {table_name} ({columns}) VALUES\n{values}\n{upsert_clause(table_name)};\n")
+        batch.clear()
+
+    for product in products:
+        batch.append(product_row(product))
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+
+def write_copy(products, table_name, out):
+    """COPY every product into a staging table, then upsert them all at once."""
+    columns = ', '.join(fields)
+    staging = f"{table_name}_staging"
+    # seq is the position of a product in the input
+    out.write(f"CREATE TEMP TABLE {staging} (LIKE {table_name} INCLUDING DEFAULTS, seq bigint) ON COMMIT DROP;\n")
+    out.write(f"COPY {staging} ({columns}, seq) FROM STDIN;\n")
+    for seq, product in enumerate(products):
+        out.write('\t'.join(copy_field(value) for value in product_row(product) + (seq,)) + '\n')
+    out.write('\\.\n')
+    # a statement cannot update the same row twice, keep the last copy of an id like write_inserts
+    out.write(f"INSERT INTO {table_name} ({columns}) SELECT DISTINCT ON (id) {columns} FROM {staging} "
+              f"ORDER BY id, seq DESC {upsert_clause(table_name)};\n")
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a psql script that upserts products into the catalog table.')
+    parser.add_argument('products', nargs='?', default='products.json', help='products JSON file, - for stdin')
+    parser.add_argument('--table', default='catalog_items')
+    parser.add_argument('--format', choices=['copy', 'insert'], default='copy',
+                        help='COPY through a staging table, or multi-row INSERT statements')
+    parser.add_argument('--batch-size', type=int, default=1000, help='rows per INSERT statement')
+    args = parser.parse_args()
+
+    out = sys.stdout
+    f = sys.stdin if args.products == '-' else open(args.products, 'r', encoding='utf-8')
+    with f:
+        out.write("BEGIN;\n")
+        if args.format == 'copy':
+            write_copy(iter_products(f), args.table, out)
+        else:
+            write_inserts(iter_products(f), args.table, args.batch_size, out)
+        out.write("COMMIT;\n")
+
+if __name__ == '__main__':
+    main()
@@ -19,11 +19,13 @@ import grpc
 import demo_pb2
 import demo_pb2_grpc
 
+import channel_pool
 from logger import getJSONLogger
 logger = getJSONLogger('emailservice-client')
 
 def send_confirmation_email(email, order):
-  channel = grpc.insecure_channel('[::]:8080')
+  # reuse one channel for every call instead of connecting each time
+  channel = channel_pool.get_channel('[::]:8080')
   stub = demo_pb2_grpc.EmailServiceStub(channel)
   try:
     response = stub.SendOrderConfirmation(demo_pb2.SendOrderConfirmationRequest(
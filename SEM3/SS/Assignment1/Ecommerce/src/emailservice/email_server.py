@@ -16,12 +16,16 @@
 
 from concurrent import futures
 import argparse
+import asyncio
 import os
+import queue
+import stat
 import sys
 import time
 import grpc
 import traceback
-from jinja2 import Environment, FileSystemLoader, select_autoescape, TemplateError
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, select_autoescape, TemplateError
+from markupsafe import Markup
 from google.api_core.exceptions import GoogleAPICallError
 from google.auth.exceptions import DefaultCredentialsError
 
@@ -31,22 +35,48 @@ from grpc_health.v1 import health_pb2
 from grpc_health.v1 import health_pb2_grpc
 
 from opentelemetry import trace
-from opentelemetry.instrumentation.grpc import GrpcInstrumentorServer
+from opentelemetry.instrumentation.grpc import GrpcInstrumentorServer, GrpcAioInstrumentorServer
 from opentelemetry.sdk.trace import TracerProvider
 from opentelemetry.sdk.trace.export import BatchSpanProcessor
 from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
 
 import googlecloudprofiler
 
-from logger import getJSONLogger
+import metrics
+import sampling_profiler
+import server_config
+from mail_queue import Message, create_mail_queue
+from logger import getJSONLogger, get_log_stats
 logger = getJSONLogger('emailservice-server')
 
+def template_bytecode_cache():
+  """Compiled templates are cached on disk so restarts skip recompiling them.
+
+  Cached bytecode is loaded as code, so the directory must be private: by
+  default Jinja picks a per-user directory it creates with mode 0700 and
+  checks, EMAIL_TEMPLATE_CACHE_DIR must be owned by us and not writable by
+  anyone else.
+  """
+  cache_dir = os.environ.get('EMAIL_TEMPLATE_CACHE_DIR')
+  if not cache_dir:
+    return FileSystemBytecodeCache()
+  os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+  info = os.lstat(cache_dir)
+  if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+    raise Exception('EMAIL_TEMPLATE_CACHE_DIR {} must be a directory owned by this user '
+                    'and writable only by it'.format(cache_dir))
+  return FileSystemBytecodeCache(cache_dir)
+
 # Loads confirmation email template from file
 env = Environment(
     loader=FileSystemLoader('templates'),
-    autoescape=select_autoescape(['html', 'xml'])
+    autoescape=select_autoescape(['html', 'xml']),
+    bytecode_cache=template_bytecode_cache(),
+    auto_reload=False
 )
-template = env.get_template('confirmation.html')
+# The head does not depend on the order, so it is rendered once
+static_head = Markup(env.get_template('confirmation_head.html').render())
+template = env.get_template('confirmation.html', globals={'static_head': static_head})
 
 class BaseEmailService(demo_pb2_grpc.EmailServiceServicer):
   def Check(self, request, context):
@@ -109,18 +139,92 @@ class DummyEmailService(BaseEmailService):
     logger.info('A request to send order confirmation email to {} has been received.'.format(request.email))
     return demo_pb2.Empty()
 
+class AsyncDummyEmailService(demo_pb2_grpc.EmailServiceServicer):
+  """DummyEmailService for the grpc.aio server."""
+  async def SendOrderConfirmation(self, request, context):
+    logger.info('A request to send order confirmation email to {} has been received.'.format(request.email))
+    return demo_pb2.Empty()
+
+  async def Check(self, request, context):
+    return health_pb2.HealthCheckResponse(
+      status=health_pb2.HealthCheckResponse.SERVING)
+
+  async def Watch(self, request, context):
+    await context.abort(grpc.StatusCode.UNIMPLEMENTED, 'health watch is not implemented')
+
+def queue_confirmation(mail_queue, request, context):
+  try:
+    confirmation = template.render(order = request.order)
+  except TemplateError as err:
+    context.set_details("An error occurred when preparing the confirmation mail.")
+    logger.error(err.message)
+    context.set_code(grpc.StatusCode.INTERNAL)
+    return demo_pb2.Empty()
+
+  try:
+    mail_queue.enqueue(Message(request.email, "Your Confirmation Email", confirmation))
+  except queue.Full:
+    context.set_details("The outbound mail queue is full.")
+    logger.warning('Mail queue full, rejected confirmation email to {}.'.format(request.email))
+    context.set_code(grpc.StatusCode.RESOURCE_EXHAUSTED)
+  return demo_pb2.Empty()
+
+class QueuedEmailService(BaseEmailService):
+  """Renders confirmations and hands them to the outbound mail queue, which
+  delivers them in batches, so the RPC does not wait on the mail backend."""
+  def __init__(self, mail_queue):
+    super().__init__()
+    self.mail_queue = mail_queue
+
+  def SendOrderConfirmation(self, request, context):
+    return queue_confirmation(self.mail_queue, request, context)
+
+class AsyncQueuedEmailService(AsyncDummyEmailService):
+  """QueuedEmailService for the grpc.aio server."""
+  def __init__(self, mail_queue):
+    super().__init__()
+    self.mail_queue = mail_queue
+
+  async def SendOrderConfirmation(self, request, context):
+    return queue_confirmation(self.mail_queue, request, context)
+
 class HealthCheck():
   def Check(self, request, context):
     return health_pb2.HealthCheckResponse(
       status=health_pb2.HealthCheckResponse.SERVING)
 
 def start(dummy_mode):
-  server = grpc.server(futures.ThreadPoolExecutor(max_workers=10),)
-  service = None
-  if dummy_mode:
-    service = DummyEmailService()
-  else:
-    raise Exception('non-dummy mode not implemented yet')
+  mail_queue = None
+  if not dummy_mode:
+    mail_queue = create_mail_queue(os.environ['MAIL_BACKEND'])
+
+  # Prometheus metrics on their own port, next to the gRPC health service
+  metrics_port = int(os.environ.get('METRICS_PORT', "9090"))
+  if metrics_port:
+    metrics.watch_stats('log_handler', 'Async log handler counters.', get_log_stats)
+    if mail_queue:
+      metrics.watch_stats('mail_queue', 'Outbound mail queue counters.', mail_queue.get_stats)
+    metrics.start_http_server(metrics_port)
+    logger.info("serving metrics on port: {}".format(metrics_port))
+
+  if server_config.server_mode() == 'aio':
+    try:
+      asyncio.run(start_aio(mail_queue))
+    except KeyboardInterrupt:
+      pass
+    finally:
+      if mail_queue:
+        mail_queue.close()
+    return
+
+  executor = futures.ThreadPoolExecutor(max_workers=server_config.max_workers())
+  metrics.watch_thread_pool(executor)
+  server = grpc.server(
+    executor,
+    interceptors=[metrics.MetricsInterceptor()],
+    options=server_config.server_options(),
+    maximum_concurrent_rpcs=server_config.max_concurrent_rpcs())
+  service = DummyEmailService() if dummy_mode else QueuedEmailService(mail_queue)
 
   demo_pb2_grpc.add_EmailServiceServicer_to_server(service, server)
   health_pb2_grpc.add_HealthServicer_to_server(service, server)
@@ -134,6 +238,29 @@ def start(dummy_mode):
       time.sleep(3600)
   except KeyboardInterrupt:
     server.stop(0)
+    if mail_queue:
+      mail_queue.close()
+
+async def start_aio(mail_queue=None):
+  # RPCs are multiplexed on one event loop, so concurrency is bounded by
+  # GRPC_MAX_CONCURRENT_RPCS instead of the size of a thread pool
+  server = grpc.aio.server(
+    interceptors=[metrics.AsyncMetricsInterceptor()],
+    options=server_config.server_options(),
+    maximum_concurrent_rpcs=server_config.max_concurrent_rpcs())
+  service = AsyncQueuedEmailService(mail_queue) if mail_queue else AsyncDummyEmailService()
+
+  demo_pb2_grpc.add_EmailServiceServicer_to_server(service, server)
+  health_pb2_grpc.add_HealthServicer_to_server(service, server)
+
+  port = os.environ.get('PORT', "8080")
+  logger.info("listening on port: "+port+" (grpc.aio)")
+  server.add_insecure_port('[::]:'+port)
+  await server.start()
+  try:
+    await server.wait_for_termination()
+  finally:
+    await server.stop(0)
 
 def initStackdriverProfiling():
   project_id = None
@@ -162,12 +289,22 @@ def initStackdriverProfiling():
 
 
 if __name__ == '__main__':
-  logger.info('starting the email service in dummy mode.')
+  # MAIL_BACKEND ("stub" or "smtp") sends real confirmation emails through
+  # the outbound mail queue, otherwise requests are only logged
+  dummy_mode = "MAIL_BACKEND" not in os.environ
+  if dummy_mode:
+    logger.info('starting the email service in dummy mode.')
+  else:
+    logger.info('starting the email service with mail backend {}.'.format(os.environ['MAIL_BACKEND']))
 
   # Profiler
   try:
     if "DISABLE_PROFILER" in os.environ:
       raise KeyError()
+    elif os.environ.get("PROFILER_MODE", "cloud") == "local":
+      # sample the gRPC worker threads (and the event loop in aio mode) into local files
+      logger.info("Local profiler enabled.")
+      sampling_profiler.start_from_env('email_server', 'ThreadPoolExecutor|MainThread|mail-sender')
     else:
       logger.info("Profiler enabled.")
       initStackdriverProfiling()
@@ -189,10 +326,12 @@ if __name__ == '__main__':
       )
     grpc_server_instrumentor = GrpcInstrumentorServer()
     grpc_server_instrumentor.instrument()
+    grpc_aio_server_instrumentor = GrpcAioInstrumentorServer()
+    grpc_aio_server_instrumentor.instrument()
 
   except (KeyError, DefaultCredentialsError):
       logger.info("Tracing disabled.")
   except Exception as e:
       logger.warn(f"Exception on Cloud Trace setup: {traceback.format_exc()}, tracing disabled.") 
   
-  start(dummy_mode = True)
+  start(dummy_mode = dummy_mode)
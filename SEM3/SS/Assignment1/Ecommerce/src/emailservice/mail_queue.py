@@ -0,0 +1,265 @@
+#!/usr/bin/python
+#
+# Copyright 2026 The MTECH-Public Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import os
+import queue
+import random
+import smtplib
+import threading
+import time
+from email.message import EmailMessage
+
+import metrics
+from logger import getJSONLogger
+logger = getJSONLogger('emailservice-queue')
+
+Message = collections.namedtuple('Message', ['to', 'subject', 'html_body'])
+
+class MailDeliveryError(Exception):
+  """Part or all of a batch was not delivered.
+
+  retry holds the messages that failed for a transient reason and may be sent
+  again, None meaning the whole batch. rejected holds the messages the mail
+  server refused permanently, which are not retried.
+  """
+  def __init__(self, message, retry=None, rejected=()):
+    super().__init__(message)
+    self.retry = retry
+    self.rejected = list(rejected)
+
+def _is_permanent(err):
+  """Whether the SMTP server refused a message for good (a 5xx reply)."""
+  if isinstance(err, smtplib.SMTPRecipientsRefused):
+    return all(code >= 500 for code, _ in err.recipients.values())
+  return isinstance(err, smtplib.SMTPResponseException) and err.smtp_code >= 500
+
+class StubMailBackend():
+  """Local mail sink that keeps delivered messages in memory.
+
+  latency and failure_rate simulate a slow or flaky mail backend so the
+  queue's batching and retries can be exercised without one.
+  """
+
+  def __init__(self, latency=0.0, failure_rate=0.0, max_kept=1000):
+    self.latency = latency
+    self.failure_rate = failure_rate
+    self.sent = collections.deque(maxlen=max_kept)
+    self.batches = 0
+
+  def send_batch(self, messages):
+    time.sleep(self.latency)
+    if random.random() < self.failure_rate:
+      raise MailDeliveryError('stub mail backend failure')
+    self.sent.extend(messages)
+    self.batches += 1
+    logger.info('Stub mail sink accepted {} messages.'.format(len(messages)))
+
+class SmtpMailBackend():
+  """Delivers each batch over a single SMTP connection.
+
+  A message the server refuses does not stop the batch: the remaining
+  messages are still sent, and the refused ones are reported in the raised
+  MailDeliveryError, as rejected for 5xx replies and to retry otherwise. When
+  the connection is lost, the message being sent and all after it are retried.
+  """
+
+  def __init__(self, host, port, sender, username=None, password=None, starttls=False, timeout=10):
+    self.host = host
+    self.port = port
+    self.sender = sender
+    self.username = username
+    self.password = password
+    self.starttls = starttls
+    self.timeout = timeout
+
+  def _mail(self, message):
+    mail = EmailMessage()
+    mail['From'] = self.sender
+    mail['To'] = message.to
+    mail['Subject'] = message.subject
+    mail.set_content(message.html_body, subtype='html')
+    return mail
+
+  def send_batch(self, messages):
+    retry = []
+    rejected = []
+    last_error = None
+    sending = False
+    try:
+      with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+        if self.starttls:
+          smtp.starttls()
+        if self.username:
+          smtp.login(self.username, self.password)
+        sending = True
+        for i, message in enumerate(messages):
+          try:
+            smtp.send_message(self._mail(message))
+          except smtplib.SMTPServerDisconnected as err:
+            # the connection is gone, nothing after this message was sent
+            retry.extend(messages[i:])
+            last_error = err
+            break
+          except smtplib.SMTPException as err:
+            if _is_permanent(err):
+              logger.error('Mail server rejected the message to {}: {}'.format(message.to, err))
+              rejected.append(message)
+            else:
+              retry.append(message)
+            last_error = err
+          except OSError as err:
+            retry.extend(messages[i:])
+            last_error = err
+            break
+    except (smtplib.SMTPException, OSError) as err:
+      # an error while closing the connection does not undo what was sent
+      if not sending:
+        raise MailDeliveryError(str(err))
+    if retry or rejected:
+      raise MailDeliveryError(str(last_error), retry=retry, rejected=rejected)
+
+class MailQueue():
+  """Bounded outbound queue that delivers messages in batches.
+
+  concurrency worker threads each take up to batch_size messages, waiting at
+  most max_wait seconds to fill a batch, and hand them to the backend. Messages
+  that failed for a transient reason are retried max_retries times with
+  exponential backoff, messages the backend rejected are dropped right away.
+  """
+
+  def __init__(self, backend, batch_size=50, max_wait=0.05, concurrency=4,
+               max_retries=3, retry_backoff=0.5, max_queue_size=10000):
+    self.backend = backend
+    self.batch_size = batch_size
+    self.max_wait = max_wait
+    self.concurrency = concurrency
+    self.max_retries = max_retries
+    self.retry_backoff = retry_backoff
+    self._queue = queue.Queue(maxsize=max_queue_size)
+    self._threads = []
+    self._lock = threading.Lock()
+    self._stats = {'queued': 0, 'sent': 0, 'rejected': 0, 'failed': 0, 'retries': 0, 'batches': 0}
+
+  def start(self):
+    for i in range(self.concurrency):
+      thread = threading.Thread(target=self._run, name='mail-sender-{}'.format(i), daemon=True)
+      thread.start()
+      self._threads.append(thread)
+
+  def enqueue(self, message):
+    """Queue a message for delivery, raising queue.Full when the queue is full."""
+    self._queue.put_nowait(message)
+    self._count('queued')
+
+  def close(self):
+    """Deliver what is already queued, then stop the workers."""
+    for _ in self._threads:
+      self._queue.put(None)
+    for thread in self._threads:
+      thread.join()
+    self._threads = []
+
+  def get_stats(self):
+    with self._lock:
+      return dict(self._stats, queue_depth=self._queue.qsize())
+
+  def _count(self, key, n=1):
+    with self._lock:
+      self._stats[key] += n
+
+  def _next_batch(self):
+    """Block for the next batch; the second value is False once the queue is closed."""
+    first = self._queue.get()
+    if first is None:
+      return [], False
+    batch = [first]
+    deadline = time.monotonic() + self.max_wait
+    while len(batch) < self.batch_size:
+      remaining = deadline - time.monotonic()
+      try:
+        message = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+      except queue.Empty:
+        break
+      if message is None:
+        return batch, False
+      batch.append(message)
+    return batch, True
+
+  def _deliver(self, batch):
+    backend_name = type(self.backend).__name__
+    for attempt in range(self.max_retries + 1):
+      start = time.perf_counter()
+      try:
+        self.backend.send_batch(batch)
+        metrics.observe_downstream('mail', backend_name, time.perf_counter() - start)
+        self._count('sent', len(batch))
+        self._count('batches')
+        return
+      except Exception as err:
+        metrics.observe_downstream('mail', backend_name, time.perf_counter() - start, ok=False)
+        retry = getattr(err, 'retry', None)
+        retry = batch if retry is None else retry
+        rejected = getattr(err, 'rejected', [])
+        self._count('sent', len(batch) - len(retry) - len(rejected))
+        if rejected:
+          logger.error('Dropping {} messages rejected by the mail backend.'.format(len(rejected)))
+          self._count('rejected', len(rejected))
+        batch = retry
+        if not batch:
+          self._count('batches')
+          return
+        if attempt == self.max_retries:
+          logger.error('Giving up on {} messages after {} attempts: {}'.format(len(batch), attempt + 1, err))
+          self._count('failed', len(batch))
+          return
+        logger.warning('Mail delivery failed, retrying {} messages: {}'.format(len(batch), err))
+        self._count('retries')
+        time.sleep(self.retry_backoff * (2 ** attempt))
+
+  def _run(self):
+    running = True
+    while running:
+      batch, running = self._next_batch()
+      if batch:
+        self._deliver(batch)
+
+def create_mail_queue(backend_name):
+  """Build and start the queue for MAIL_BACKEND ("stub" or "smtp") from the environment."""
+  if backend_name == 'stub':
+    backend = StubMailBackend(
+      latency=float(os.environ.get('STUB_MAIL_LATENCY_SECONDS', "0")),
+      failure_rate=float(os.environ.get('STUB_MAIL_FAILURE_RATE', "0")))
+  elif backend_name == 'smtp':
+    backend = SmtpMailBackend(
+      os.environ.get('SMTP_HOST', 'localhost'),
+      int(os.environ.get('SMTP_PORT', "25")),
+      os.environ.get('MAIL_FROM', 'noreply@example.com'),
+      username=os.environ.get('SMTP_USERNAME'),
+      password=os.environ.get('SMTP_PASSWORD'),
+      starttls=os.environ.get('SMTP_STARTTLS') == "1")
+  else:
+    raise Exception('unknown MAIL_BACKEND: {}'.format(backend_name))
+
+  mail_queue = MailQueue(
+    backend,
+    batch_size=int(os.environ.get('MAIL_BATCH_SIZE', "50")),
+    max_wait=float(os.environ.get('MAIL_BATCH_WAIT_SECONDS', "0.05")),
+    concurrency=int(os.environ.get('MAIL_SEND_CONCURRENCY', "4")),
+    max_retries=int(os.environ.get('MAIL_MAX_RETRIES', "3")),
+    max_queue_size=int(os.environ.get('MAIL_QUEUE_SIZE', "10000")))
+  mail_queue.start()
+  return mail_queue
@@ -0,0 +1,59 @@
+#!/usr/bin/python
+#
+# Copyright 2026 The MTECH-Public Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+SERVER_MODES = ('sync', 'aio')
+
+def _env_int(name, default=None):
+  value = os.environ.get(name, '')
+  return int(value) if value != '' else default
+
+def server_mode():
+  """GRPC_SERVER_MODE: "sync" for a thread pool server, "aio" for grpc.aio."""
+  mode = os.environ.get('GRPC_SERVER_MODE', 'sync')
+  if mode not in SERVER_MODES:
+    raise Exception('GRPC_SERVER_MODE must be one of {}, got {}'.format(SERVER_MODES, mode))
+  return mode
+
+def max_workers():
+  """GRPC_MAX_WORKERS: threads handling RPCs in sync mode."""
+  return _env_int('GRPC_MAX_WORKERS', 10)
+
+def max_concurrent_rpcs():
+  """GRPC_MAX_CONCURRENT_RPCS: RPCs in flight before new ones are rejected with
+  RESOURCE_EXHAUSTED, unlimited when unset."""
+  return _env_int('GRPC_MAX_CONCURRENT_RPCS')
+
+def server_options():
+  """Channel arguments for grpc.server and grpc.aio.server, only those whose
+  environment variable is set, gRPC's own defaults apply to the rest."""
+  settings = [
+    # HTTP/2 streams (RPCs) one client connection may multiplex
+    ('grpc.max_concurrent_streams', 'GRPC_MAX_CONCURRENT_STREAMS'),
+    ('grpc.keepalive_time_ms', 'GRPC_KEEPALIVE_TIME_MS'),
+    ('grpc.keepalive_timeout_ms', 'GRPC_KEEPALIVE_TIMEOUT_MS'),
+    ('grpc.keepalive_permit_without_calls', 'GRPC_KEEPALIVE_PERMIT_WITHOUT_CALLS'),
+    # accept client pings this often, must not exceed the clients' keepalive time
+    ('grpc.http2.min_ping_interval_without_data_ms', 'GRPC_MIN_PING_INTERVAL_MS'),
+    ('grpc.max_connection_idle_ms', 'GRPC_MAX_CONNECTION_IDLE_MS'),
+  ]
+  options = []
+  for key, env_name in settings:
+    value = _env_int(env_name)
+    if value is not None:
+      options.append((key, value))
+  return options
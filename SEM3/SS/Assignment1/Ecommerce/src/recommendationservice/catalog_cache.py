@@ -0,0 +1,149 @@
+#!/usr/bin/python
+#
+# Copyright 2026 The MTECH-Public Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import threading
+import time
+
+from logger import getJSONLogger
+logger = getJSONLogger('recommendationservice-catalog')
+
+def catalog_fingerprint(products):
+  """Digest of the product fields the recommenders are built from."""
+  digest = hashlib.sha256()
+  for p in products:
+    for value in (p.id, p.name, p.description, *p.categories):
+      digest.update(value.encode('utf-8'))
+      digest.update(b'\0')
+    digest.update(b'\1')
+  return digest.hexdigest()
+
+class CatalogSnapshot():
+  """Locally held copy of the product catalog, refreshed in the background.
+
+  fetch is called with no arguments and returns the products, and build
+  turns them into the catalog that is served, e.g. a ProductIndex or
+  ContentRecommender, so anything derived from the catalog is built once
+  per refresh rather than per request. When fingerprint is given and the
+  fetched products have the same fingerprint as the current snapshot, the
+  build is skipped and the snapshot only counts as refreshed. The
+  snapshot is refreshed every refresh_interval seconds, or as soon as
+  invalidate() is called. When a refresh fails the previous snapshot keeps
+  being served (stale-while-revalidate), so the catalog service being down
+  does not take recommendations down with it.
+  """
+
+  def __init__(self, fetch, build=lambda products: products, fingerprint=None,
+               refresh_interval=60, retry_interval=5):
+    self._fetch = fetch
+    self._build = build
+    self._fingerprint = fingerprint
+    self._current_fingerprint = None
+    self.refresh_interval = refresh_interval
+    self.retry_interval = retry_interval
+    self._catalog = None
+    self._loaded_at = None
+    self._lock = threading.Lock()
+    # one fetch and build at a time, whether from the refresher or a request
+    self._refresh_lock = threading.RLock()
+    self._attempts = 0
+    self._wakeup = threading.Event()
+    self._stopped = threading.Event()
+    self._thread = None
+    self.stats = {'refreshes': 0, 'refresh_errors': 0, 'rebuilds': 0}
+
+  def start(self):
+    """Load the first snapshot and start the background refresher.
+
+    A failed initial load is not fatal: the refresher keeps retrying and
+    requests fall back to a synchronous fetch until a snapshot exists.
+    """
+    self.refresh()
+    self._thread = threading.Thread(target=self._run, name='catalog-refresher', daemon=True)
+    self._thread.start()
+
+  def stop(self):
+    self._stopped.set()
+    self._wakeup.set()
+    if self._thread:
+      self._thread.join()
+
+  def invalidate(self):
+    """Ask the refresher to reload the catalog now instead of at the next interval."""
+    logger.info("Catalog snapshot invalidated")
+    self._wakeup.set()
+
+  def refresh(self):
+    """Fetch the catalog and swap it in. Returns True on success."""
+    with self._refresh_lock:
+      try:
+        products = self._fetch()
+        fingerprint = self._fingerprint(products) if self._fingerprint else None
+        unchanged = fingerprint is not None and fingerprint == self._current_fingerprint
+        catalog = self._catalog if unchanged else self._build(products)
+      except Exception as err:
+        # counted once finished, so requests that waited on it see the failure
+        self._attempts += 1
+        with self._lock:
+          self.stats['refresh_errors'] += 1
+        logger.warning("Catalog refresh failed, serving previous snapshot: {}".format(err))
+        return False
+      with self._lock:
+        self._catalog = catalog
+        self._current_fingerprint = fingerprint
+        self._loaded_at = time.time()
+        self.stats['refreshes'] += 1
+        if not unchanged:
+          self.stats['rebuilds'] += 1
+      self._attempts += 1
+    if unchanged:
+      logger.info("Catalog unchanged, keeping snapshot of {} products".format(len(catalog)))
+    else:
+      logger.info("Catalog snapshot rebuilt: {} products".format(len(catalog)))
+    return True
+
+  def current(self):
+    """Return the current snapshot, fetching synchronously if none has loaded yet.
+
+    Concurrent requests without a snapshot wait for a single fetch; when that
+    fetch fails they all fail instead of each fetching again.
+    """
+    catalog = self._catalog
+    if catalog is not None:
+      return catalog
+    attempts = self._attempts
+    with self._refresh_lock:
+      catalog = self._catalog
+      if catalog is None:
+        if self._attempts != attempts or not self.refresh():
+          raise RuntimeError('product catalog unavailable and no snapshot loaded')
+        catalog = self._catalog
+    return catalog
+
+  def age(self):
+    """Seconds since the snapshot was last refreshed, or None before the first load."""
+    loaded_at = self._loaded_at
+    return None if loaded_at is None else time.time() - loaded_at
+
+  def _run(self):
+    while not self._stopped.is_set():
+      # Retry sooner while there is no snapshot at all
+      interval = self.refresh_interval if self._catalog is not None else self.retry_interval
+      self._wakeup.wait(interval)
+      self._wakeup.clear()
+      if self._stopped.is_set():
+        return
+      self.refresh()
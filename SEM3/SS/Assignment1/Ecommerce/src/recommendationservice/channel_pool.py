@@ -0,0 +1,113 @@
+#!/usr/bin/python
+#
+# Copyright 2026 The MTECH-Public Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import itertools
+import json
+import os
+import threading
+
+import grpc
+
+def _env_int(name, default):
+  value = os.environ.get(name, '')
+  return int(value) if value != '' else default
+
+def service_config(max_attempts=3):
+  """Client service config: round robin over every resolved address, and
+  retries with backoff for calls that fail with UNAVAILABLE."""
+  config = {
+    "loadBalancingConfig": [{"round_robin": {}}],
+    "retryThrottling": {"maxTokens": 10, "tokenRatio": 0.1},
+  }
+  if max_attempts > 1:
+    config["methodConfig"] = [{
+      # an empty name matches every method of every service
+      "name": [{}],
+      "retryPolicy": {
+        "maxAttempts": max_attempts,
+        "initialBackoff": "0.1s",
+        "maxBackoff": "1s",
+        "backoffMultiplier": 2,
+        "retryableStatusCodes": ["UNAVAILABLE"],
+      },
+    }]
+  return json.dumps(config)
+
+def channel_options():
+  """Channel arguments for pooled client channels."""
+  return [
+    # Go gRPC servers by default reject pings more often than every 5 minutes
+    # or without an active RPC, and answer with GOAWAY "too_many_pings"
+    ('grpc.keepalive_time_ms', _env_int('GRPC_CLIENT_KEEPALIVE_TIME_MS', 300000)),
+    ('grpc.keepalive_timeout_ms', _env_int('GRPC_CLIENT_KEEPALIVE_TIMEOUT_MS', 20000)),
+    ('grpc.keepalive_permit_without_calls', _env_int('GRPC_CLIENT_KEEPALIVE_PERMIT_WITHOUT_CALLS', 0)),
+    ('grpc.enable_retries', 1),
+    ('grpc.service_config', service_config(_env_int('GRPC_CLIENT_MAX_ATTEMPTS', 3))),
+  ]
+
+class ChannelPool():
+  """Long lived client channels, shared by every caller of the same target.
+
+  channels_per_target > 1 opens that many channels per target, each with its
+  own connections, and hands them out in turn. Every channel load balances
+  over all the addresses the target resolves to.
+  """
+
+  def __init__(self, channels_per_target=1, options=None):
+    self.channels_per_target = max(1, channels_per_target)
+    self._options = options
+    self._channels = {}
+    self._lock = threading.Lock()
+    self._stats = {}
+
+  def get_channel(self, target):
+    with self._lock:
+      entry = self._channels.get(target)
+      stats = self._stats.setdefault(target, {'channels_created': 0, 'reuses': 0})
+      if entry is not None:
+        stats['reuses'] += 1
+      else:
+        options = list(self._options if self._options is not None else channel_options())
+        if self.channels_per_target > 1:
+          # keep gRPC from sharing one connection between the channels
+          options.append(('grpc.use_local_subchannel_pool', 1))
+        channels = [grpc.insecure_channel(target, options=options)
+                    for _ in range(self.channels_per_target)]
+        stats['channels_created'] += len(channels)
+        entry = (channels, itertools.cycle(channels))
+        self._channels[target] = entry
+      return next(entry[1])
+
+  def get_stats(self):
+    """Per target counts of channels created and of requests served by an existing one."""
+    with self._lock:
+      return {target: dict(stats) for target, stats in self._stats.items()}
+
+  def close(self):
+    with self._lock:
+      for channels, _ in self._channels.values():
+        for channel in channels:
+          channel.close()
+      self._channels.clear()
+
+_pool = ChannelPool(channels_per_target=_env_int('GRPC_CHANNELS_PER_TARGET', 1))
+
+def get_channel(target):
+  """Return a pooled channel to target from the process wide pool."""
+  return _pool.get_channel(target)
+
+def get_stats():
+  return _pool.get_stats()
@@ -37,3 +37,10 @@ if __name__ == "__main__":
     # make call to server
     response = stub.ListRecommendations(request)
     logger.info(response)
+
+    # ask for several users' recommendations in one call
+    batch = demo_pb2.BatchListRecommendationsRequest(requests=[
+        demo_pb2.ListRecommendationsRequest(user_id="test-{}".format(i), product_ids=["test"])
+        for i in range(3)])
+    for response in stub.BatchListRecommendations(batch):
+        logger.info(response)
@@ -170,6 +170,11 @@ class RecommendationServiceStub(object):
                 request_serializer=demo__pb2.ListRecommendationsRequest.SerializeToString,
                 response_deserializer=demo__pb2.ListRecommendationsResponse.FromString,
                 )
+        self.BatchListRecommendations = channel.unary_stream(
+                '/hipstershop.RecommendationService/BatchListRecommendations',
+                request_serializer=demo__pb2.BatchListRecommendationsRequest.SerializeToString,
+                response_deserializer=demo__pb2.BatchListRecommendationsResponse.FromString,
+                )
 
 
 class RecommendationServiceServicer(object):
@@ -183,6 +188,14 @@ class RecommendationServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def BatchListRecommendations(self, request, context):
+        """Answers many ListRecommendationsRequests in one call, streaming one
+        response per request as soon as it is ready.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_RecommendationServiceServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -191,6 +204,11 @@ def add_RecommendationServiceServicer_to_server(servicer, server):
                     request_deserializer=demo__pb2.ListRecommendationsRequest.FromString,
                     response_serializer=demo__pb2.ListRecommendationsResponse.SerializeToString,
             ),
+            'BatchListRecommendations': grpc.unary_stream_rpc_method_handler(
+                    servicer.BatchListRecommendations,
+                    request_deserializer=demo__pb2.BatchListRecommendationsRequest.FromString,
+                    response_serializer=demo__pb2.BatchListRecommendationsResponse.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'hipstershop.RecommendationService', rpc_method_handlers)
@@ -220,6 +238,23 @@ class RecommendationService(object):
             options, channel_credentials,
             insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
 
+    @staticmethod
+    def BatchListRecommendations(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(request, target, '/hipstershop.RecommendationService/BatchListRecommendations',
+            demo__pb2.BatchListRecommendationsRequest.SerializeToString,
+            demo__pb2.BatchListRecommendationsResponse.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
 
 class ProductCatalogServiceStub(object):
     """---------------Product Catalog----------------
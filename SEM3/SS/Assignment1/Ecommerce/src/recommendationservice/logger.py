@@ -14,8 +14,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import atexit
+import collections
+import json
 import logging
+import os
+import random
 import sys
+import threading
 from pythonjsonlogger import jsonlogger
 
 # TODO(yoshifumi) this class is duplicated since other Python services are
@@ -30,11 +36,159 @@ class CustomJsonFormatter(jsonlogger.JsonFormatter):
     else:
       log_record['severity'] = record.levelname
 
+class FastJsonFormatter(logging.Formatter):
+  """Writes the same fields as CustomJsonFormatter with a single json.dumps
+  call instead of python-json-logger's generic field merging."""
+  def format(self, record):
+    log_record = {
+      'timestamp': record.created,
+      'severity': record.levelname,
+      'name': record.name,
+      'message': record.getMessage(),
+    }
+    if record.exc_info:
+      log_record['exc_info'] = self.formatException(record.exc_info)
+    return json.dumps(log_record, default=str)
+
+class AsyncBatchHandler(logging.Handler):
+  """Hands records to a background thread that formats and writes them in batches.
+
+  emit() only appends to an in-memory buffer, so the calling (request) thread
+  never serializes or writes. The writer wakes every flush_interval seconds,
+  or as soon as batch_size records are waiting. When the buffer is full the
+  record is dropped and counted instead of blocking. Records at INFO and
+  below are kept with probability info_sample_rate; warnings and errors are
+  always kept.
+  """
+
+  def __init__(self, stream, max_queue_size=10000, batch_size=256, flush_interval=0.05, info_sample_rate=1.0):
+    super().__init__()
+    self.stream = stream
+    self.max_queue_size = max_queue_size
+    self.batch_size = batch_size
+    self.flush_interval = flush_interval
+    self.info_sample_rate = info_sample_rate
+    # deque appends and pops are atomic, so emit() takes no lock
+    self._buffer = collections.deque()
+    self._wakeup = threading.Event()
+    self._stopped = False
+    self._stats_lock = threading.Lock()
+    self._stats = {'written': 0, 'dropped': 0, 'sampled_out': 0}
+    self._reported_drops = 0
+    self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+    self._thread.start()
+
+  def emit(self, record):
+    try:
+      if record.levelno <= logging.INFO and self.info_sample_rate < 1.0 \
+          and random.random() >= self.info_sample_rate:
+        self._count('sampled_out')
+        return
+      if len(self._buffer) >= self.max_queue_size:
+        self._count('dropped')
+        return
+      # resolve the message now, its arguments may change after this call
+      record.msg = record.getMessage()
+      record.args = None
+      self._buffer.append(record)
+      if len(self._buffer) >= self.batch_size:
+        self._wakeup.set()
+    except Exception:
+      # like StreamHandler, a bad log call must not fail the caller
+      self.handleError(record)
+
+  def get_stats(self):
+    with self._stats_lock:
+      return dict(self._stats, queue_depth=len(self._buffer))
+
+  def flush(self):
+    """Ask the writer to write out what is buffered now."""
+    self._wakeup.set()
+
+  def close(self):
+    """Write out everything already buffered, then stop the writer thread."""
+    self._stopped = True
+    self._wakeup.set()
+    self._thread.join()
+    super().close()
+
+  def _count(self, key, n=1):
+    with self._stats_lock:
+      self._stats[key] += n
+
+  def _run(self):
+    while True:
+      self._wakeup.wait(self.flush_interval)
+      self._wakeup.clear()
+      stopping = self._stopped
+      while self._buffer:
+        self._write_batch()
+      if stopping:
+        return
+
+  def _write_batch(self):
+    lines = []
+    count = 0
+    while count < self.batch_size:
+      try:
+        record = self._buffer.popleft()
+      except IndexError:
+        break
+      count += 1
+      try:
+        lines.append(self.format(record))
+      except Exception:
+        self.handleError(record)
+    lines.extend(self._drop_report())
+    if lines:
+      try:
+        self.stream.write('\n'.join(lines) + '\n')
+        self.stream.flush()
+      except Exception:
+        pass
+    self._count('written', count)
+
+  def _drop_report(self):
+    with self._stats_lock:
+      dropped = self._stats['dropped'] - self._reported_drops
+      self._reported_drops = self._stats['dropped']
+    if not dropped:
+      return []
+    record = logging.LogRecord('logger', logging.WARNING, __file__, 0,
+      'log buffer full, dropped %d records', (dropped,), None)
+    return [self.format(record)]
+
+_async_handler = None
+_async_handler_lock = threading.Lock()
+
+def _get_async_handler():
+  """One writer thread per process, shared by every JSON logger."""
+  global _async_handler
+  with _async_handler_lock:
+    if _async_handler is None:
+      _async_handler = AsyncBatchHandler(
+        sys.stdout,
+        max_queue_size=int(os.environ.get('LOG_QUEUE_SIZE', "10000")),
+        batch_size=int(os.environ.get('LOG_BATCH_SIZE', "256")),
+        flush_interval=float(os.environ.get('LOG_FLUSH_INTERVAL_SECONDS', "0.05")),
+        info_sample_rate=float(os.environ.get('LOG_INFO_SAMPLE_RATE', "1.0")))
+      _async_handler.setFormatter(FastJsonFormatter())
+      atexit.register(_async_handler.close)
+    return _async_handler
+
+def get_log_stats():
+  """Counters of the async handler: written, dropped, sampled_out and queue_depth."""
+  return _async_handler.get_stats() if _async_handler else {}
+
 def getJSONLogger(name):
   logger = logging.getLogger(name)
-  handler = logging.StreamHandler(sys.stdout)
-  formatter = CustomJsonFormatter('%(timestamp)s %(severity)s %(name)s %(message)s')
-  handler.setFormatter(formatter)
+  if os.environ.get('LOG_ASYNC', "1") == "0":
+    # synchronous python-json-logger output, written on the calling thread
+    handler = logging.StreamHandler(sys.stdout)
+    formatter = CustomJsonFormatter('%(timestamp)s %(severity)s %(name)s %(message)s')
+    handler.setFormatter(formatter)
+  else:
+    handler = _get_async_handler()
   logger.addHandler(handler)
   logger.setLevel(logging.INFO)
   logger.propagate = False
@@ -0,0 +1,297 @@
+#!/usr/bin/python
+#
+# Copyright 2026 The MTECH-Public Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import grpc
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _labels(labels):
+  if not labels:
+    return ''
+  return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                        for k, v in labels) + '}'
+
+class Registry():
+  """Counters, gauges and histograms rendered in the Prometheus text format.
+
+  Samples are keyed by metric name and a tuple of (label, value) pairs.
+  Callback gauges are evaluated at scrape time, for values that already
+  live elsewhere such as queue depths.
+  """
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._help = {}
+    self._types = {}
+    self._values = {}
+    self._histograms = {}
+    self._callbacks = []
+
+  def _declare(self, name, kind, help_text):
+    self._types.setdefault(name, kind)
+    self._help.setdefault(name, help_text)
+
+  def inc(self, name, labels=(), value=1, help_text=''):
+    with self._lock:
+      self._declare(name, 'counter', help_text)
+      key = (name, labels)
+      self._values[key] = self._values.get(key, 0) + value
+
+  def add(self, name, labels=(), value=1, help_text=''):
+    """Move a gauge up or down."""
+    with self._lock:
+      self._declare(name, 'gauge', help_text)
+      key = (name, labels)
+      self._values[key] = self._values.get(key, 0) + value
+
+  def observe(self, name, labels, value, help_text='', buckets=LATENCY_BUCKETS):
+    with self._lock:
+      self._declare(name, 'histogram', help_text)
+      key = (name, labels)
+      histogram = self._histograms.get(key)
+      if histogram is None:
+        histogram = self._histograms[key] = [buckets, [0] * (len(buckets) + 1), 0.0]
+      histogram[1][bisect.bisect_left(buckets, value)] += 1
+      histogram[2] += value
+
+  def gauge_callback(self, name, help_text, fn):
+    """Register fn, returning a number or a {labels: number} dict, as a gauge."""
+    with self._lock:
+      self._declare(name, 'gauge', help_text)
+      self._callbacks.append((name, fn))
+
+  def render(self):
+    with self._lock:
+      values = dict(self._values)
+      histograms = {key: (h[0], list(h[1]), h[2]) for key, h in self._histograms.items()}
+      callbacks = list(self._callbacks)
+    for name, fn in callbacks:
+      try:
+        result = fn()
+      except Exception:
+        continue
+      if isinstance(result, dict):
+        for labels, value in result.items():
+          values[(name, labels)] = value
+      elif result is not None:
+        values[(name, ())] = result
+
+    by_name = {}
+    for (name, labels), value in values.items():
+      by_name.setdefault(name, []).append('{}{} {}'.format(name, _labels(labels), value))
+    for (name, labels), (buckets, counts, total) in histograms.items():
+      lines = by_name.setdefault(name, [])
+      cumulative = 0
+      for bound, count in zip(buckets + (float('inf'),), counts):
+        cumulative += count
+        le = '+Inf' if bound == float('inf') else repr(bound)
+        lines.append('{}_bucket{} {}'.format(name, _labels(labels + (('le', le),)), cumulative))
+      lines.append('{}_sum{} {}'.format(name, _labels(labels), total))
+      lines.append('{}_count{} {}'.format(name, _labels(labels), cumulative))
+
+    out = []
+    for name in sorted(by_name):
+      if self._help.get(name):
+        out.append('# HELP {} {}'.format(name, self._help[name]))
+      out.append('# TYPE {} {}'.format(name, self._types[name]))
+      out.extend(by_name[name])
+    return '\n'.join(out) + '\n'
+
+REGISTRY = Registry()
+
+def _record_rpc(method, code, elapsed):
+  REGISTRY.observe('grpc_server_handling_seconds', (('grpc_method', method),), elapsed,
+                   'Time to handle an RPC, by method.')
+  REGISTRY.inc('grpc_server_handled_total', (('grpc_method', method), ('grpc_code', code)),
+               help_text='RPCs completed, by method and status code.')
+
+def _in_flight(method, delta):
+  REGISTRY.add('grpc_server_in_flight', (('grpc_method', method),), delta,
+               'RPCs currently being handled, by method.')
+
+def _code_name(context, default='OK'):
+  code = context.code() if hasattr(context, 'code') else None
+  if isinstance(code, grpc.StatusCode):
+    return code.name
+  return default
+
+class MetricsInterceptor(grpc.ServerInterceptor):
+  """Records latency, completion codes and in-flight counts of every RPC."""
+
+  def intercept_service(self, continuation, handler_call_details):
+    handler = continuation(handler_call_details)
+    if handler is None:
+      return None
+    method = handler_call_details.method
+    if handler.unary_unary:
+      return handler._replace(unary_unary=self._wrap_unary(handler.unary_unary, method))
+    if handler.unary_stream:
+      return handler._replace(unary_stream=self._wrap_stream(handler.unary_stream, method))
+    return handler
+
+  @staticmethod
+  def _wrap_unary(behavior, method):
+    def wrapper(request, context):
+      _in_flight(method, 1)
+      start = time.perf_counter()
+      code = 'UNKNOWN'
+      try:
+        response = behavior(request, context)
+        code = _code_name(context)
+        return response
+      finally:
+        _record_rpc(method, code, time.perf_counter() - start)
+        _in_flight(method, -1)
+    return wrapper
+
+  @staticmethod
+  def _wrap_stream(behavior, method):
+    def wrapper(request, context):
+      _in_flight(method, 1)
+      start = time.perf_counter()
+      code = 'UNKNOWN'
+      try:
+        for response in behavior(request, context):
+          yield response
+        code = _code_name(context)
+      finally:
+        _record_rpc(method, code, time.perf_counter() - start)
+        _in_flight(method, -1)
+    return wrapper
+
+class AsyncMetricsInterceptor(grpc.aio.ServerInterceptor):
+  """MetricsInterceptor for the grpc.aio server."""
+
+  async def intercept_service(self, continuation, handler_call_details):
+    handler = await continuation(handler_call_details)
+    if handler is None:
+      return None
+    method = handler_call_details.method
+    if handler.unary_unary:
+      return handler._replace(unary_unary=self._wrap_unary(handler.unary_unary, method))
+    if handler.unary_stream:
+      return handler._replace(unary_stream=self._wrap_stream(handler.unary_stream, method))
+    return handler
+
+  @staticmethod
+  def _wrap_unary(behavior, method):
+    async def wrapper(request, context):
+      _in_flight(method, 1)
+      start = time.perf_counter()
+      code = 'UNKNOWN'
+      try:
+        response = await behavior(request, context)
+        code = _code_name(context)
+        return response
+      except grpc.aio.AbortError:
+        code = _code_name(context, 'UNKNOWN')
+        raise
+      finally:
+        _record_rpc(method, code, time.perf_counter() - start)
+        _in_flight(method, -1)
+    return wrapper
+
+  @staticmethod
+  def _wrap_stream(behavior, method):
+    async def wrapper(request, context):
+      _in_flight(method, 1)
+      start = time.perf_counter()
+      code = 'UNKNOWN'
+      try:
+        responses = behavior(request, context)
+        if hasattr(responses, '__aiter__'):
+          async for response in responses:
+            yield response
+        else:
+          # handlers may also write with context.write() and return nothing
+          await responses
+        code = _code_name(context)
+      except grpc.aio.AbortError:
+        code = _code_name(context, 'UNKNOWN')
+        raise
+      finally:
+        _record_rpc(method, code, time.perf_counter() - start)
+        _in_flight(method, -1)
+    return wrapper
+
+def observe_downstream(target, method, elapsed, ok=True):
+  """Record the time spent in a call to another service."""
+  labels = (('target', target), ('method', method))
+  REGISTRY.observe('downstream_call_seconds', labels, elapsed,
+                   'Time spent in calls to other services.')
+  if not ok:
+    REGISTRY.inc('downstream_call_errors_total', labels,
+                 help_text='Failed calls to other services.')
+
+class DownstreamMetricsInterceptor(grpc.UnaryUnaryClientInterceptor):
+  """Client interceptor that records downstream_call_seconds for every call."""
+
+  def __init__(self, target):
+    self.target = target
+
+  def intercept_unary_unary(self, continuation, client_call_details, request):
+    start = time.perf_counter()
+    call = continuation(client_call_details, request)
+    def done(future):
+      ok = future.exception() is None
+      observe_downstream(self.target, client_call_details.method, time.perf_counter() - start, ok)
+    call.add_done_callback(done)
+    return call
+
+def watch_thread_pool(executor):
+  """Export the backlog and size of the server's ThreadPoolExecutor."""
+  REGISTRY.gauge_callback('grpc_server_pool_queue_depth',
+                          'RPCs waiting for a free server thread.',
+                          lambda: executor._work_queue.qsize())
+  REGISTRY.gauge_callback('grpc_server_pool_threads',
+                          'Threads started by the server thread pool.',
+                          lambda: len(executor._threads))
+
+def watch_stats(name, help_text, get_stats):
+  """Export every number in a get_stats() style dict as a gauge labelled by key."""
+  def collect():
+    return {(('stat', key),): value for key, value in get_stats().items()
+            if isinstance(value, (int, float))}
+  REGISTRY.gauge_callback(name, help_text, collect)
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+  def do_GET(self):
+    if self.path != '/metrics':
+      self.send_error(404)
+      return
+    body = REGISTRY.render().encode('utf-8')
+    self.send_response(200)
+    self.send_header('Content-Type', 'text/plain; version=0.0.4')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    # scrapes would otherwise be written to stderr
+    pass
+
+def start_http_server(port):
+  """Serve /metrics on port from a daemon thread."""
+  server = ThreadingHTTPServer(('', port), MetricsRequestHandler)
+  server.daemon_threads = True
+  thread = threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True)
+  thread.start()
+  return server
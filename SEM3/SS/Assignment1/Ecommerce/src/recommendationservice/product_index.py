@@ -0,0 +1,68 @@
+#!/usr/bin/python
+#
+# Copyright 2026 The MTECH-Public Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+
+class ProductIndex():
+  """Immutable, array-backed index of the product catalog.
+
+  Built once per catalog snapshot so requests only do O(k) work: sample()
+  draws uniformly at random from the catalog and rejects excluded or already
+  chosen ids, instead of materializing the catalog minus the exclusions.
+  """
+
+  def __init__(self, products):
+    self.products = list(products)
+    # drop duplicate ids, keeping catalog order
+    self.ids = list(dict.fromkeys(p.id for p in self.products))
+    self._positions = {product_id: i for i, product_id in enumerate(self.ids)}
+
+  def __len__(self):
+    return len(self.ids)
+
+  def __contains__(self, product_id):
+    return product_id in self._positions
+
+  def sample(self, k, exclude=(), rng=random):
+    """Return up to k distinct product ids not in exclude, uniformly at random.
+
+    Every k-subset of the eligible ids is equally likely, exactly as with
+    random.sample over the filtered list.
+    """
+    excluded = {self._positions[x] for x in exclude if x in self._positions}
+    eligible = len(self.ids) - len(excluded)
+    k = min(k, eligible)
+    if k <= 0:
+      return []
+
+    # Rejection sampling needs about n/eligible draws per pick; when most of
+    # the catalog is excluded, filtering is cheaper
+    if eligible < 2 * k or eligible * 2 < len(self.ids):
+      remaining = [x for i, x in enumerate(self.ids) if i not in excluded]
+      return rng.sample(remaining, k)
+
+    chosen = []
+    seen = set(excluded)
+    while len(chosen) < k:
+      i = rng.randrange(len(self.ids))
+      if i not in seen:
+        seen.add(i)
+        chosen.append(self.ids[i])
+    return chosen
+
+  def recommend(self, product_ids, k):
+    """Return k random products that are not in product_ids."""
+    return self.sample(k, exclude=product_ids)
@@ -14,8 +14,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
 import os
-import random
+import signal
 import time
 import traceback
 from concurrent import futures
@@ -30,12 +31,19 @@ from grpc_health.v1 import health_pb2
 from grpc_health.v1 import health_pb2_grpc
 
 from opentelemetry import trace
-from opentelemetry.instrumentation.grpc import GrpcInstrumentorClient, GrpcInstrumentorServer
+from opentelemetry.instrumentation.grpc import GrpcInstrumentorClient, GrpcInstrumentorServer, GrpcAioInstrumentorServer
 from opentelemetry.sdk.trace import TracerProvider
 from opentelemetry.sdk.trace.export import BatchSpanProcessor
 from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
 
-from logger import getJSONLogger
+import channel_pool
+import metrics
+import sampling_profiler
+import server_config
+from catalog_cache import CatalogSnapshot, catalog_fingerprint
+from product_index import ProductIndex
+from recommender import ContentRecommender
+from logger import getJSONLogger, get_log_stats
 logger = getJSONLogger('recommendationservice-server')
 
 def initStackdriverProfiling():
@@ -63,24 +71,32 @@ def initStackdriverProfiling():
         logger.warning("Could not initialize Stackdriver Profiler after retrying, giving up")
   return
 
+MAX_RESPONSES = 5
+
+def list_recommendations(catalog, request):
+    # answer from the local catalog snapshot, skipping the products in the request
+    prod_list = catalog.recommend(request.product_ids, MAX_RESPONSES)
+    logger.info("[Recv ListRecommendations] product_ids={}".format(prod_list))
+    # build and return response
+    response = demo_pb2.ListRecommendationsResponse()
+    response.product_ids.extend(prod_list)
+    return response
+
+def batch_list_recommendations(catalog, request):
+    # every request in the batch is answered from the same catalog snapshot
+    logger.info("[Recv BatchListRecommendations] requests={}".format(len(request.requests)))
+    for index, item in enumerate(request.requests):
+        yield demo_pb2.BatchListRecommendationsResponse(
+            index=index,
+            user_id=item.user_id,
+            product_ids=catalog.recommend(item.product_ids, MAX_RESPONSES))
+
 class RecommendationService(demo_pb2_grpc.RecommendationServiceServicer):
     def ListRecommendations(self, request, context):
-        max_responses = 5
-        # fetch list of products from product catalog stub
-        cat_response = product_catalog_stub.ListProducts(demo_pb2.Empty())
-        product_ids = [x.id for x in cat_response.products]
-        filtered_products = list(set(product_ids)-set(request.product_ids))
-        num_products = len(filtered_products)
-        num_return = min(max_responses, num_products)
-        # sample list of indicies to return
-        indices = random.sample(range(num_products), num_return)
-        # fetch product ids from indices
-        prod_list = [filtered_products[i] for i in indices]
-        logger.info("[Recv ListRecommendations] product_ids={}".format(prod_list))
-        # build and return response
-        response = demo_pb2.ListRecommendationsResponse()
-        response.product_ids.extend(prod_list)
-        return response
+        return list_recommendations(catalog_snapshot.current(), request)
+
+    def BatchListRecommendations(self, request, context):
+        return batch_list_recommendations(catalog_snapshot.current(), request)
 
     def Check(self, request, context):
         return health_pb2.HealthCheckResponse(
@@ -90,6 +106,77 @@ class RecommendationService(demo_pb2_grpc.RecommendationServiceServicer):
         return health_pb2.HealthCheckResponse(
             status=health_pb2.HealthCheckResponse.UNIMPLEMENTED)
 
+class AsyncRecommendationService(demo_pb2_grpc.RecommendationServiceServicer):
+    """RecommendationService for the grpc.aio server."""
+    async def ListRecommendations(self, request, context):
+        if catalog_snapshot.age() is None:
+            # no snapshot yet, fetch it without blocking the event loop
+            catalog = await asyncio.to_thread(catalog_snapshot.current)
+        else:
+            catalog = catalog_snapshot.current()
+        return list_recommendations(catalog, request)
+
+    async def BatchListRecommendations(self, request, context):
+        if catalog_snapshot.age() is None:
+            catalog = await asyncio.to_thread(catalog_snapshot.current)
+        else:
+            catalog = catalog_snapshot.current()
+        for response in batch_list_recommendations(catalog, request):
+            yield response
+
+    async def Check(self, request, context):
+        return health_pb2.HealthCheckResponse(
+            status=health_pb2.HealthCheckResponse.SERVING)
+
+    async def Watch(self, request, context):
+        await context.abort(grpc.StatusCode.UNIMPLEMENTED, 'health watch is not implemented')
+
+def serve(port):
+    executor = futures.ThreadPoolExecutor(max_workers=server_config.max_workers())
+    metrics.watch_thread_pool(executor)
+    server = grpc.server(
+        executor,
+        interceptors=[metrics.MetricsInterceptor()],
+        options=server_config.server_options(),
+        maximum_concurrent_rpcs=server_config.max_concurrent_rpcs())
+
+    # add class to gRPC server
+    service = RecommendationService()
+    demo_pb2_grpc.add_RecommendationServiceServicer_to_server(service, server)
+    health_pb2_grpc.add_HealthServicer_to_server(service, server)
+
+    # start server
+    logger.info("listening on port: " + port)
+    server.add_insecure_port('[::]:'+port)
+    server.start()
+
+    # keep alive
+    try:
+        while True:
+            time.sleep(10000)
+    except KeyboardInterrupt:
+        server.stop(0)
+
+async def serve_aio(port):
+    # RPCs are multiplexed on one event loop, so concurrency is bounded by
+    # GRPC_MAX_CONCURRENT_RPCS instead of the size of a thread pool
+    server = grpc.aio.server(
+        interceptors=[metrics.AsyncMetricsInterceptor()],
+        options=server_config.server_options(),
+        maximum_concurrent_rpcs=server_config.max_concurrent_rpcs())
+
+    service = AsyncRecommendationService()
+    demo_pb2_grpc.add_RecommendationServiceServicer_to_server(service, server)
+    health_pb2_grpc.add_HealthServicer_to_server(service, server)
+
+    logger.info("listening on port: " + port + " (grpc.aio)")
+    server.add_insecure_port('[::]:'+port)
+    await server.start()
+    try:
+        await server.wait_for_termination()
+    finally:
+        await server.stop(0)
+
 
 if __name__ == "__main__":
     logger.info("initializing recommendationservice")
@@ -97,6 +184,10 @@ if __name__ == "__main__":
     try:
       if "DISABLE_PROFILER" in os.environ:
         raise KeyError()
+      elif os.environ.get("PROFILER_MODE", "cloud") == "local":
+        # sample the gRPC worker threads (and the event loop in aio mode) into local files
+        logger.info("Local profiler enabled.")
+        sampling_profiler.start_from_env('recommendation_server', 'ThreadPoolExecutor|MainThread')
       else:
         logger.info("Profiler enabled.")
         initStackdriverProfiling()
@@ -108,6 +199,8 @@ if __name__ == "__main__":
       grpc_client_instrumentor.instrument()
       grpc_server_instrumentor = GrpcInstrumentorServer()
       grpc_server_instrumentor.instrument()
+      grpc_aio_server_instrumentor = GrpcAioInstrumentorServer()
+      grpc_aio_server_instrumentor.instrument()
       if os.environ["ENABLE_TRACING"] == "1":
         trace.set_tracer_provider(TracerProvider())
         otel_endpoint = os.getenv("COLLECTOR_SERVICE_ADDR", "localhost:4317")
@@ -129,25 +222,55 @@ if __name__ == "__main__":
     if catalog_addr == "":
         raise Exception('PRODUCT_CATALOG_SERVICE_ADDR environment variable not set')
     logger.info("product catalog address: " + catalog_addr)
-    channel = grpc.insecure_channel(catalog_addr)
-    product_catalog_stub = demo_pb2_grpc.ProductCatalogServiceStub(channel)
+    downstream_metrics = metrics.DownstreamMetricsInterceptor('productcatalogservice')
 
-    # create gRPC server
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    def list_products():
+        # take a channel from the pool on every fetch, so the
+        # GRPC_CHANNELS_PER_TARGET channels are used in turn
+        channel = grpc.intercept_channel(channel_pool.get_channel(catalog_addr), downstream_metrics)
+        stub = demo_pb2_grpc.ProductCatalogServiceStub(channel)
+        return stub.ListProducts(demo_pb2.Empty(), timeout=10).products
 
-    # add class to gRPC server
-    service = RecommendationService()
-    demo_pb2_grpc.add_RecommendationServiceServicer_to_server(service, server)
-    health_pb2_grpc.add_HealthServicer_to_server(service, server)
+    # "content" recommends similar products, "random" samples the catalog uniformly
+    recommendation_mode = os.environ.get('RECOMMENDATION_MODE', "content")
+    if recommendation_mode == "random":
+        build_catalog = ProductIndex
+    else:
+        neighbors = int(os.environ.get('RECOMMENDATION_NEIGHBORS', "20"))
+        build_catalog = lambda products: ContentRecommender(ProductIndex(products), top_n=neighbors)
+    logger.info("recommendation mode: " + recommendation_mode)
 
-    # start server
-    logger.info("listening on port: " + port)
-    server.add_insecure_port('[::]:'+port)
-    server.start()
+    # keep a local copy of the catalog instead of fetching it on every request;
+    # the neighbor table is rebuilt off the request path, and only when the
+    # fetched catalog differs from the one it was built from
+    refresh_interval = float(os.environ.get('CATALOG_REFRESH_INTERVAL_SECONDS', "60"))
+    catalog_snapshot = CatalogSnapshot(
+        list_products,
+        build=build_catalog,
+        fingerprint=catalog_fingerprint,
+        refresh_interval=refresh_interval)
+    catalog_snapshot.start()
+    # SIGHUP forces a refresh, e.g. after the catalog has been updated
+    signal.signal(signal.SIGHUP, lambda signum, frame: catalog_snapshot.invalidate())
+    logger.info("catalog refresh interval: {}s".format(refresh_interval))
 
-    # keep alive
-    try:
-         while True:
-            time.sleep(10000)
-    except KeyboardInterrupt:
-            server.stop(0)
+    # Prometheus metrics on their own port, next to the gRPC health service
+    metrics_port = int(os.environ.get('METRICS_PORT', "9090"))
+    if metrics_port:
+        metrics.watch_stats('log_handler', 'Async log handler counters.', get_log_stats)
+        metrics.watch_stats('catalog_snapshot', 'Catalog snapshot refresh counters.',
+                            lambda: dict(catalog_snapshot.stats, age_seconds=catalog_snapshot.age()))
+        metrics.REGISTRY.gauge_callback(
+            'grpc_client_channel_reuses', 'Requests served by an already open client channel.',
+            lambda: {(('target', target),): stats['reuses'] for target, stats in channel_pool.get_stats().items()})
+        metrics.start_http_server(metrics_port)
+        logger.info("serving metrics on port: {}".format(metrics_port))
+
+    # create and run the gRPC server
+    if server_config.server_mode() == 'aio':
+        try:
+            asyncio.run(serve_aio(port))
+        except KeyboardInterrupt:
+            pass
+    else:
+        serve(port)
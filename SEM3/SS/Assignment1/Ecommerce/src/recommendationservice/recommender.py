@@ -0,0 +1,150 @@
+#!/usr/bin/python
+#
+# Copyright 2026 The MTECH-Public Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+import re
+from collections import Counter
+
+import numpy as np
+from scipy import sparse
+
+# Category overlap counts this many times more than shared description words
+CATEGORY_WEIGHT = 2.0
+# Upper bound on rows of the similarity matrix computed at once
+BLOCK_SIZE = 1024
+# Upper bound on the cells of one dense similarity block, 64MB of float32
+BLOCK_ELEMENTS = 1 << 24
+
+STOP_WORDS = frozenset("""
+  a an and are as at be by for from has have in is it its of on or that the
+  this to with your you our will can all any into more than these those
+""".split())
+
+def tokenize(text):
+  return [t for t in re.findall(r"[a-z0-9]+", text.lower()) if len(t) > 2 and t not in STOP_WORDS]
+
+def item_vectors(products):
+  """Return a sparse matrix with one L2-normalized row per product from its
+  categories, name and description.
+
+  Words are TF-IDF weighted, categories are one-hot, and the two blocks are
+  normalized separately so a long description does not drown out categories.
+  Only the words and categories a product has are stored, so memory grows
+  with the catalog's text rather than with products x vocabulary.
+  """
+  docs = [Counter(tokenize(p.name + " " + p.description)) for p in products]
+  terms = {}
+  doc_freq = Counter()
+  for doc in docs:
+    doc_freq.update(doc.keys())
+  for term in doc_freq:
+    terms[term] = len(terms)
+  categories = {}
+  for p in products:
+    for category in p.categories:
+      categories.setdefault(category.lower(), len(categories))
+
+  rows, cols, values = [], [], []
+  for row, doc in enumerate(docs):
+    for term, count in doc.items():
+      idf = math.log((1 + len(products)) / (1 + doc_freq[term])) + 1
+      rows.append(row)
+      cols.append(terms[term])
+      values.append(count * idf)
+  text = sparse.csr_matrix((values, (rows, cols)), shape=(len(products), len(terms)), dtype=np.float32)
+  # a product listing a category twice still counts it once
+  cat_cells = {(row, categories[category.lower()]) for row, p in enumerate(products) for category in p.categories}
+  cat_rows = [row for row, _ in cat_cells]
+  cat_cols = [col for _, col in cat_cells]
+  cats = sparse.csr_matrix((np.ones(len(cat_cells), dtype=np.float32), (cat_rows, cat_cols)),
+                           shape=(len(products), len(categories)), dtype=np.float32)
+
+  vectors = sparse.hstack([_normalize(text), CATEGORY_WEIGHT * _normalize(cats)], format="csr")
+  return _normalize(vectors)
+
+def _normalize(matrix):
+  norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+  norms[norms == 0] = 1.0
+  return sparse.diags((1.0 / norms).astype(np.float32)) @ matrix
+
+def neighbor_table(vectors, top_n):
+  """Return (indices, scores) of the top_n most similar other items for every row.
+
+  Similarities are computed a block of rows at a time, as many as fit in
+  BLOCK_ELEMENTS cells, so memory stays bounded instead of growing n x n.
+  """
+  n = vectors.shape[0]
+  top_n = min(top_n, n - 1)
+  indices = np.zeros((n, max(top_n, 0)), dtype=np.int64)
+  scores = np.zeros((n, max(top_n, 0)), dtype=np.float32)
+  if top_n <= 0:
+    return indices, scores
+
+  block_size = max(1, min(BLOCK_SIZE, BLOCK_ELEMENTS // n))
+  transposed = vectors.T.tocsc()
+  for start in range(0, n, block_size):
+    block = (vectors[start:start + block_size] @ transposed).toarray()
+    rows = np.arange(len(block))
+    # an item is never its own neighbor
+    block[rows, start + rows] = -np.inf
+    top = np.argpartition(-block, top_n - 1, axis=1)[:, :top_n]
+    top_scores = np.take_along_axis(block, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind="stable")
+    indices[start:start + len(block)] = np.take_along_axis(top, order, axis=1)
+    scores[start:start + len(block)] = np.take_along_axis(top_scores, order, axis=1)
+  return indices, scores
+
+class ContentRecommender():
+  """Recommends products similar to the ones in the cart.
+
+  The neighbor table is built once per catalog snapshot, so a request only
+  merges the precomputed neighbor lists of its product ids. When the cart
+  is empty or has too few neighbors, the rest is sampled uniformly from the
+  catalog as before.
+  """
+
+  def __init__(self, index, top_n=20):
+    self.index = index
+    self._neighbors = {}
+    if len(index) == 0:
+      return
+    products = {}
+    for p in index.products:
+      products.setdefault(p.id, p)
+    vectors = item_vectors([products[product_id] for product_id in index.ids])
+    indices, scores = neighbor_table(vectors, top_n)
+    for row, product_id in enumerate(index.ids):
+      self._neighbors[product_id] = [
+        (index.ids[i], float(s)) for i, s in zip(indices[row], scores[row]) if s > 0]
+
+  def __len__(self):
+    return len(self.index)
+
+  def neighbors(self, product_id):
+    return self._neighbors.get(product_id, [])
+
+  def recommend(self, product_ids, k):
+    """Return up to k product ids ranked by total similarity to product_ids."""
+    exclude = set(product_ids)
+    totals = {}
+    for product_id in exclude:
+      for neighbor, score in self.neighbors(product_id):
+        if neighbor not in exclude:
+          totals[neighbor] = totals.get(neighbor, 0.0) + score
+    ranked = sorted(totals, key=totals.get, reverse=True)[:k]
+    if len(ranked) < k:
+      ranked.extend(self.index.sample(k - len(ranked), exclude=exclude.union(ranked)))
+    return ranked
@@ -0,0 +1,125 @@
+#!/usr/bin/python
+#
+# Copyright 2026 The MTECH-Public Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import atexit
+import collections
+import os
+import re
+import sys
+import threading
+import time
+
+from logger import getJSONLogger
+logger = getJSONLogger('sampling-profiler')
+
+class SamplingProfiler():
+  """Wall clock sampling profiler that needs nothing but a local directory.
+
+  Every interval seconds the stacks of the threads whose names match
+  thread_pattern are captured from sys._current_frames(). Every
+  flush_interval seconds the counts are written to output_dir in the
+  collapsed stack format ("thread;outer;...;inner count" per line), which
+  flamegraph.pl, speedscope and inferno read directly.
+
+  If sampling takes more than max_overhead of wall time, the interval is
+  doubled (up to max_interval) until it fits again.
+  """
+
+  def __init__(self, service, output_dir, interval=0.01, flush_interval=60.0,
+               thread_pattern='.*', max_overhead=0.01, max_interval=1.0, max_depth=64):
+    self.service = service
+    self.output_dir = output_dir
+    self.interval = interval
+    self.min_interval = interval
+    self.max_interval = max_interval
+    self.flush_interval = flush_interval
+    self.thread_pattern = re.compile(thread_pattern)
+    self.max_overhead = max_overhead
+    self.max_depth = max_depth
+    self._counts = collections.Counter()
+    self._samples = 0
+    self._stopped = threading.Event()
+    self._thread = None
+
+  def start(self):
+    os.makedirs(self.output_dir, exist_ok=True)
+    self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+    self._thread.start()
+
+  def stop(self):
+    self._stopped.set()
+    if self._thread:
+      self._thread.join()
+    self.flush()
+
+  def _sample(self):
+    names = {t.ident: t.name for t in threading.enumerate()}
+    own = threading.get_ident()
+    for ident, frame in sys._current_frames().items():
+      name = names.get(ident)
+      if ident == own or name is None or not self.thread_pattern.match(name):
+        continue
+      stack = []
+      while frame is not None and len(stack) < self.max_depth:
+        code = frame.f_code
+        stack.append('{}:{}'.format(os.path.basename(code.co_filename), code.co_name))
+        frame = frame.f_back
+      stack.append(re.sub(r'_\d+$', '', name))
+      self._counts[';'.join(reversed(stack))] += 1
+    self._samples += 1
+
+  def flush(self):
+    """Write the samples collected since the last flush and reset them."""
+    counts, self._counts = self._counts, collections.Counter()
+    if not counts:
+      return None
+    path = os.path.join(self.output_dir, '{}-{}-{}.collapsed'.format(
+      self.service, time.strftime('%Y%m%dT%H%M%S'), os.getpid()))
+    with open(path, 'w') as f:
+      for stack, count in counts.most_common():
+        f.write('{} {}\n'.format(stack, count))
+    logger.info('Wrote {} stack samples to {}'.format(sum(counts.values()), path))
+    return path
+
+  def _run(self):
+    next_flush = time.monotonic() + self.flush_interval
+    while not self._stopped.wait(self.interval):
+      start = time.perf_counter()
+      self._sample()
+      spent = time.perf_counter() - start
+      # keep the share of wall time spent sampling under max_overhead
+      if spent > self.max_overhead * self.interval and self.interval < self.max_interval:
+        self.interval = min(self.interval * 2, self.max_interval)
+      elif spent * 4 < self.max_overhead * self.interval and self.interval > self.min_interval:
+        self.interval = max(self.interval / 2, self.min_interval)
+      if time.monotonic() >= next_flush:
+        self.flush()
+        next_flush = time.monotonic() + self.flush_interval
+
+def start_from_env(service, default_threads):
+  """Start a SamplingProfiler configured by the PROFILER_* environment variables."""
+  profiler = SamplingProfiler(
+    service,
+    os.environ.get('PROFILER_OUTPUT_DIR', '/tmp/profiles'),
+    interval=float(os.environ.get('PROFILER_SAMPLE_INTERVAL_MS', "10")) / 1000,
+    flush_interval=float(os.environ.get('PROFILER_FLUSH_SECONDS', "60")),
+    thread_pattern=os.environ.get('PROFILER_THREADS', default_threads),
+    max_overhead=float(os.environ.get('PROFILER_MAX_OVERHEAD', "0.01")))
+  profiler.start()
+  atexit.register(profiler.stop)
+  logger.info('Local sampling profiler writing to {} every {}s'.format(
+    profiler.output_dir, profiler.flush_interval))
+  return profiler
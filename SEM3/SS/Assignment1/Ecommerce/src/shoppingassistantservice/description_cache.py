@@ -0,0 +1,145 @@
+#!/usr/bin/python
+#
+# Copyright 2026 The MTECH-Public Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+from retrieval import LRUCache
+
+
+def image_key(image_url):
+    """Content address of an image, the SHA-256 of its URL or data URL."""
+    return hashlib.sha256(image_url.encode("utf-8")).hexdigest()
+
+
+class DescriptionCache:
+    """Room descriptions keyed by image hash.
+
+    Entries live in memory (max_entries, least recently used first out) and,
+    when disk_dir is set, in one JSON file per image there as well, so they
+    survive restarts and are shared by processes on the same volume. Both tiers
+    drop entries older than ttl seconds; the disk tier is trimmed back to
+    max_disk_entries files, oldest first, every PRUNE_EVERY writes.
+    """
+
+    PRUNE_EVERY = 100
+
+    def __init__(self, max_entries=512, ttl=3600.0, disk_dir=None, max_disk_entries=10000):
+        self.ttl = ttl
+        self.memory = LRUCache(max_entries, ttl=ttl)
+        self.disk_dir = disk_dir
+        self.max_disk_entries = max_disk_entries
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "disk_errors": 0}
+        self._disk_writes = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, key + ".json")
+
+    def _read_disk(self, key):
+        try:
+            with open(self._path(key)) as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            self._count("disk_errors")
+            return None
+        if time.time() - entry["created"] > self.ttl:
+            return None
+        return entry["description"]
+
+    def _write_disk(self, key, description):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump({"created": time.time(), "description": description}, f)
+            os.replace(tmp_path, path)
+            with self._lock:
+                self._disk_writes += 1
+                prune = self._disk_writes % self.PRUNE_EVERY == 0
+            if prune:
+                self._prune_disk()
+        except OSError:
+            self._count("disk_errors")
+
+    def _prune_disk(self):
+        entries = [entry for entry in os.scandir(self.disk_dir) if entry.name.endswith(".json")]
+        if len(entries) <= self.max_disk_entries:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:len(entries) - self.max_disk_entries]:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def get(self, image_url):
+        key = image_key(image_url)
+        description = self.memory.get(key)
+        if description is not None:
+            self._count("memory_hits")
+            return description
+        if self.disk_dir:
+            description = self._read_disk(key)
+            if description is not None:
+                self._count("disk_hits")
+                self.memory.put(key, description)
+                return description
+        self._count("misses")
+        return None
+
+    def put(self, image_url, description):
+        key = image_key(image_url)
+        self.memory.put(key, description)
+        if self.disk_dir:
+            self._write_disk(key, description)
+
+    def get_or_describe(self, image_url, describe):
+        """Return the cached description of image_url, calling describe(image_url) on a miss."""
+        description = self.get(image_url)
+        if description is None:
+            description = describe(image_url)
+            self.put(image_url, description)
+        return description
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        stats["memory_entries"] = self.memory.get_stats()["size"]
+        return stats
+
+
+def create_description_cache():
+    """Build the DescriptionCache from the DESCRIPTION_CACHE_* environment variables."""
+    return DescriptionCache(
+        max_entries=int(os.environ.get("DESCRIPTION_CACHE_SIZE", "512")),
+        ttl=float(os.environ.get("DESCRIPTION_CACHE_TTL_SECONDS", "3600")),
+        disk_dir=os.environ.get("DESCRIPTION_CACHE_DIR") or None,
+        max_disk_entries=int(os.environ.get("DESCRIPTION_CACHE_DISK_ENTRIES", "10000")),
+    )
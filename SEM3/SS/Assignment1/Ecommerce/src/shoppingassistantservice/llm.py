@@ -0,0 +1,77 @@
+#!/usr/bin/python
+#
+# Copyright 2026 The MTECH-Public Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import time
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+FAKE_ROOM_DESCRIPTION = (
+    "A bright Scandinavian living room with white walls, light oak floors, "
+    "a grey fabric sofa and minimalist black metal accents.")
+FAKE_RECOMMENDATION = (
+    "This is a bright Scandinavian living room. A simple table lamp and a "
+    "small plant would suit it well. [OLJCESPC7Z], [0PUK6V6EV0], [1YMWWN1N4O]")
+
+
+class FakeChatModel(BaseChatModel):
+    """Local stand-in for Gemini that answers with canned text.
+
+    Requests with an image get a room description, all others a
+    recommendation. The reply starts after latency seconds and is streamed a
+    word at a time, token_delay seconds apart.
+    """
+
+    latency: float = 0.0
+    token_delay: float = 0.0
+
+    @property
+    def _llm_type(self):
+        return "fake-chat"
+
+    def _reply(self, messages):
+        for message in messages:
+            if isinstance(message.content, list) and any(
+                    isinstance(part, dict) and part.get("type") == "image_url" for part in message.content):
+                return FAKE_ROOM_DESCRIPTION
+        return FAKE_RECOMMENDATION
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        message = AIMessage(content=self._reply(messages))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        for i, word in enumerate(self._reply(messages).split(" ")):
+            if i:
+                time.sleep(self.token_delay)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word if i == 0 else " " + word))
+
+
+def create_chat_model():
+    """The chat model shared by every request, chosen by LLM_BACKEND ("google" or "fake")."""
+    backend = os.environ.get("LLM_BACKEND", "google")
+    if backend == "google":
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        return ChatGoogleGenerativeAI(model=os.environ.get("LLM_MODEL", "gemini-1.5-flash"))
+    if backend == "fake":
+        return FakeChatModel(
+            latency=float(os.environ.get("FAKE_LLM_LATENCY_SECONDS", "0")),
+            token_delay=float(os.environ.get("FAKE_LLM_TOKEN_DELAY_SECONDS", "0")))
+    raise ValueError(f"unknown LLM_BACKEND: {backend}")
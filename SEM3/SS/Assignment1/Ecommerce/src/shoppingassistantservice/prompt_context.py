@@ -0,0 +1,74 @@
+#!/usr/bin/python
+#
+# Copyright 2026 The MTECH-Public Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+# Rough size of a token in characters, close enough for English text with Gemini
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text):
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def truncate(text, max_chars):
+    """Cut text to at most max_chars, at a word boundary when there is one."""
+    text = " ".join(text.split())
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars - 3]
+    if " " in cut:
+        cut = cut[:cut.rindex(" ")]
+    return cut + "..."
+
+
+def product_line(doc, description_chars):
+    """One line per product: id, name, categories and the start of the description."""
+    metadata = doc.metadata
+    return "id: {} | name: {} | categories: {} | description: {}".format(
+        metadata.get("id", ""), metadata.get("name", ""), metadata.get("categories", ""),
+        truncate(doc.page_content, description_chars))
+
+
+def build_context(docs, token_budget=600, description_chars=200):
+    """Product list for the prompt, in retrieval order.
+
+    Products already listed (by id) are skipped, and products are added only
+    while the list stays within token_budget tokens.
+    """
+    seen = set()
+    lines = []
+    used = 0
+    for doc in docs:
+        product_id = doc.metadata.get("id")
+        if product_id in seen:
+            continue
+        seen.add(product_id)
+        line = product_line(doc, description_chars)
+        # +1 for the newline joining it to the previous line
+        cost = estimate_tokens(line) + (1 if lines else 0)
+        if used + cost > token_budget:
+            break
+        lines.append(line)
+        used += cost
+    return "\n".join(lines)
+
+
+def context_builder_from_env():
+    """build_context configured by CONTEXT_TOKEN_BUDGET and CONTEXT_DESCRIPTION_CHARS."""
+    token_budget = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "600"))
+    description_chars = int(os.environ.get("CONTEXT_DESCRIPTION_CHARS", "200"))
+    return lambda docs: build_context(docs, token_budget, description_chars)